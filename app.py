@@ -1,12 +1,17 @@
 import os
 import io
-import json
 import logging
-import re
-from flask import Flask, request, render_template, jsonify, redirect, url_for, make_response
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, request, render_template, jsonify, redirect, url_for, send_file, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import orjson
 from werkzeug.utils import secure_filename
-import pdfplumber
 import soundfile as sf
 import tempfile
 import traceback
@@ -14,501 +19,116 @@ from config import Config
 import numpy as np
 import base64
 from auth_service import auth_service, token_required
+from extraction import extract_words_from_pdf_bytes, extract_words_from_epub_bytes, group_words_by_lines_converted
 from kokoro import KPipeline
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
-import warnings
-warnings.filterwarnings("ignore", category=UserWarning, module="bs4")
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for faster request parsing and jsonify()"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        ).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Load configuration
 app.config.from_object(Config)
 Config.init_app(app)
 
-def extract_words_from_pdf_bytes(file_bytes):
-    """Extract words and their coordinates from PDF bytes using pdfplumber with paragraph detection."""
-    all_words = []
-    global_word_index = 0
-    global_paragraph_id = 0
-    
-    try:
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                # Extract words with precise coordinate data
-                words = page.extract_words(x_tolerance=2, use_text_flow=True)
-                
-                if not words:
-                    continue
-                
-                # Detect paragraph boundaries using line spacing and positioning
-                paragraphs = detect_paragraphs_in_page(words)
-                
-                for paragraph in paragraphs:
-                    for word in paragraph['words']:
-                        all_words.append({
-                            "text": word["text"],
-                            "page": page_num + 1,
-                            "index": global_word_index,
-                            "paragraph_id": global_paragraph_id,
-                            "paragraph_start": word.get("paragraph_start", False),
-                            "paragraph_end": word.get("paragraph_end", False),
-                            "x": float(word["x0"]),
-                            "y": float(word["top"]),
-                            "width": float(word["x1"] - word["x0"]),
-                            "height": float(word["bottom"] - word["top"]),
-                            "page_width": float(page.width),
-                            "page_height": float(page.height)
-                        })
-                        global_word_index += 1
-                    global_paragraph_id += 1
-                    
-    except Exception as e:
-        logger.error(f"pdfplumber failed to extract words: {e}")
-        return None
-    return all_words
-
-def detect_paragraphs_in_page(words):
-    """Detect paragraph boundaries using smart whitespace analysis - works for any PDF type."""
-    if not words:
-        return []
-    
-    paragraphs = []
-    current_paragraph = []
-    
-    # Group words by approximate lines first
-    lines = group_words_by_lines(words)
-    
-    # Calculate common horizontal alignment zones for better paragraph detection
-    left_margins = [line[0]["x0"] for line in lines if line]
-    common_margins = {}
-    for margin in left_margins:
-        # Group similar margins (within 5px)
-        found_group = False
-        for existing_margin in common_margins:
-            if abs(margin - existing_margin) <= 5:
-                common_margins[existing_margin] += 1
-                found_group = True
-                break
-        if not found_group:
-            common_margins[margin] = 1
-    
-    # Find the most common alignment (main text alignment)
-    main_text_margin = max(common_margins.keys(), key=common_margins.get) if common_margins else 0
-    
-    for line_idx, line_words in enumerate(lines):
-        if not line_words:
-            continue
-            
-        # Check if this line starts a new paragraph
-        is_new_paragraph = False
-        
-        if line_idx == 0:
-            # First line is always start of a paragraph
-            is_new_paragraph = True
-        else:
-            prev_line = lines[line_idx - 1] if line_idx > 0 else []
-            
-            if prev_line:
-                # Check if previous line appears incomplete (likely continues to this line)
-                prev_line_text = ' '.join(word["text"] for word in prev_line).strip()
-                current_line_text = ' '.join(word["text"] for word in line_words).strip()
-                
-                # If previous line seems incomplete, don't break here
-                if is_incomplete_line(prev_line_text, current_line_text):
-                    is_new_paragraph = False
-                else:
-                    # ENHANCED HORIZONTAL ALIGNMENT CHECK
-                    # If current line is aligned with main text body, consider it a continuation
-                    current_margin = line_words[0]["x0"]
-                    prev_margin = prev_line[0]["x0"]
-                    
-                    # Check if both lines are aligned with main text (likely continuation)
-                    both_main_aligned = (abs(current_margin - main_text_margin) <= 8 and 
-                                       abs(prev_margin - main_text_margin) <= 8)
-                    
-                    if both_main_aligned:
-                        # Both lines are main text aligned - be more conservative about splitting
-                        # Only split if there are very strong spatial indicators
-                        if (has_aggressive_vertical_spacing(line_words, prev_line) and
-                            has_significant_indentation_change(line_words, prev_line, main_text_margin)):
-                            is_new_paragraph = True
-                        elif is_clear_paragraph_break(prev_line, line_words):
-                            is_new_paragraph = True
-                    else:
-                        # SMART WHITESPACE-BASED PARAGRAPH DETECTION (original logic for non-aligned text)
-                        
-                        # 1. Vertical spacing - balanced threshold
-                        if has_aggressive_vertical_spacing(line_words, prev_line):
-                            is_new_paragraph = True
-                        
-                        # 2. Horizontal indentation changes - significant shifts
-                        elif has_indentation_change(line_words, prev_line):
-                            is_new_paragraph = True
-                        
-                        # 3. Line length analysis - short lines often indicate paragraph breaks
-                        elif is_short_line_break(prev_line, line_words):
-                            is_new_paragraph = True
-                        
-                        # 4. Font size or formatting changes (if available)
-                        elif has_formatting_change(line_words, prev_line):
-                            is_new_paragraph = True
-        
-        if is_new_paragraph and current_paragraph:
-            # Mark the end of the previous paragraph
-            if current_paragraph:
-                current_paragraph[-1]["paragraph_end"] = True
-            
-            # Save the previous paragraph
-            paragraphs.append({
-                'words': current_paragraph,
-                'paragraph_id': len(paragraphs)
-            })
-            current_paragraph = []
-        
-        # Mark paragraph start
-        if is_new_paragraph and line_words:
-            line_words[0]["paragraph_start"] = True
-        
-        # Add all words from this line to current paragraph
-        current_paragraph.extend(line_words)
-    
-    # Don't forget the last paragraph
-    if current_paragraph:
-        current_paragraph[-1]["paragraph_end"] = True
-        paragraphs.append({
-            'words': current_paragraph,
-            'paragraph_id': len(paragraphs)
-        })
-    
-    return paragraphs
-
-def is_incomplete_line(prev_line_text, current_line_text):
-    """Detect if the previous line is incomplete and continues to the current line - GENERIC for any PDF type."""
-    if not prev_line_text or not current_line_text:
-        return False
-    
-    # CONSERVATIVE APPROACH: Only split when there are STRONG indicators
-    # Don't split based on punctuation alone - rely primarily on spatial analysis
-    
-    # Very strong indicators that previous line is incomplete
-    strong_incomplete_endings = [
-        # Punctuation that clearly indicates continuation
-        ',', ';', ':', '(', '"', "'", '-', '—', '–',
-        # Words that clearly indicate incomplete thoughts
-        'and', 'or', 'but', 'the', 'of', 'in', 'to', 'for', 'with', 'by', 'at', 'on', 'from',
-        # Conjunctions and transitions that need continuation
-        'if', 'because', 'since', 'while', 'although', 'though', 'unless', 'until', 'before', 'after', 'when', 'where', 'how', 'why'
-    ]
-    
-    # Check if previous line ends with clear incomplete indicators
-    prev_clearly_incomplete = any(prev_line_text.lower().endswith(' ' + ending) or prev_line_text.endswith(ending) 
-                                 for ending in strong_incomplete_endings)
-    
-    # Very strong indicators that current line is a continuation  
-    strong_continuation_starts = [
-        # Punctuation that clearly continues previous line
-        ')', '"', "'", '.', ',', ';',
-        # Words that clearly continue previous thought
-        'and', 'or', 'but', 'so', 'yet', 'then', 'however', 'therefore', 'moreover', 'furthermore'
-    ]
-    
-    # Check if current line clearly starts a continuation
-    current_clearly_continues = any(current_line_text.lower().startswith(start + ' ') or current_line_text.startswith(start)
-                                   for start in strong_continuation_starts)
-    
-    # Strong indicator: current line starts with lowercase (very likely continuation)
-    current_starts_lowercase = current_line_text and current_line_text[0].islower()
-    
-    # Return True only for CLEAR continuation indicators
-    # This makes the algorithm rely more on spatial analysis rather than text patterns
-    return (prev_clearly_incomplete or 
-            current_clearly_continues or 
-            current_starts_lowercase)
-
-def has_aggressive_vertical_spacing(line_words, prev_line):
-    """Detect vertical spacing between lines - very aggressive for shorter chunks."""
-    if not prev_line or not line_words:
-        return False
-    
-    # Calculate vertical spacing between lines
-    prev_line_bottom = max(word["bottom"] for word in prev_line)
-    current_line_top = min(word["top"] for word in line_words)
-    line_spacing = current_line_top - prev_line_bottom
-    
-    # Calculate average line height for context
-    current_line_height = max(word["bottom"] - word["top"] for word in line_words)
-    prev_line_height = max(word["bottom"] - word["top"] for word in prev_line)
-    avg_line_height = (current_line_height + prev_line_height) / 2
-    
-    # BALANCED threshold: > 1.0x line height
-    # This will catch meaningful spacing increases while avoiding over-splitting
-    return line_spacing > avg_line_height * 1.0
+# Leading bytes every valid upload of each type must start with
+PDF_MAGIC = b'%PDF-'
+EPUB_MAGIC = b'PK\x03\x04'  # EPUB is a ZIP container
 
-def has_indentation_change(line_words, prev_line):
-    """Detect horizontal indentation changes - very aggressive for shorter chunks."""
-    if not prev_line or not line_words:
-        return False
-    
-    current_indent = line_words[0]["x0"]
-    prev_indent = prev_line[0]["x0"]
-    
-    # BALANCED threshold - meaningful indentation changes > 10 pixels
-    # This will catch significant indentation while avoiding minor variations
-    return abs(current_indent - prev_indent) > 10
+def has_valid_signature(file_bytes, is_epub):
+    """Check the file's magic bytes so renamed non-PDF/EPUB files are rejected before parsing."""
+    if is_epub:
+        return file_bytes[:len(EPUB_MAGIC)] == EPUB_MAGIC
+    # Readers accept a PDF header anywhere in the first 1024 bytes
+    return PDF_MAGIC in file_bytes[:1024]
 
-def is_short_line_break(prev_line, current_line):
-    """Detect paragraph breaks based on line length patterns - very aggressive for shorter chunks."""
-    if not prev_line or not current_line:
-        return False
-    
-    # Calculate line widths
-    prev_line_width = max(word["x1"] for word in prev_line) - min(word["x0"] for word in prev_line)
-    current_line_width = max(word["x1"] for word in current_line) - min(word["x0"] for word in current_line)
-    
-    # Get page width context (approximate)
-    page_width = max(max(word["x1"] for word in prev_line), max(word["x1"] for word in current_line))
-    
-    # Check if this looks like logical continuation vs paragraph break
-    prev_line_text = ' '.join(word["text"] for word in prev_line).strip()
-    current_line_text = ' '.join(word["text"] for word in current_line).strip()
-    
-    # Minimal continuation checking - only the most obvious cases
-    continuation_endings = [',', ';', ':', '(', '"', "'", '-']
-    logical_continuation = any(prev_line_text.endswith(ending) for ending in continuation_endings)
-    
-    # Minimal continuation starts - only obvious punctuation
-    continuation_starts = [')', '"', "'", '.', ',', ';']
-    starts_continuation = any(current_line_text.startswith(start) for start in continuation_starts)
-    
-    # Don't split only for very obvious continuations
-    if logical_continuation or starts_continuation:
-        return False
-    
-    # BALANCED line width thresholds for reasonable chunks
-    # Break if previous line is quite short (< 60% of page width) OR
-    # there's a significant width difference (> 30%)
-    if (prev_line_width < page_width * 0.60 or 
-        abs(prev_line_width - current_line_width) > page_width * 0.30):
-        return True
-    
-    return False
+# Recently extracted word lists keyed by (sha256 of file content, is_epub), so
+# re-uploading the same book skips parsing entirely. Stored as orjson bytes, which
+# are several times smaller than the equivalent list of dicts.
+_extraction_cache = OrderedDict()
+_extraction_cache_lock = threading.Lock()
 
-def has_formatting_change(line_words, prev_line):
-    """Detect formatting changes like font size differences - very aggressive for shorter chunks."""
-    if not prev_line or not line_words:
-        return False
-    
-    # Check if word height differs significantly (indicating font size change)
-    current_heights = [word["bottom"] - word["top"] for word in line_words]
-    prev_heights = [word["bottom"] - word["top"] for word in prev_line]
-    
-    if current_heights and prev_heights:
-        avg_current_height = sum(current_heights) / len(current_heights)
-        avg_prev_height = sum(prev_heights) / len(prev_heights)
-        
-        # BALANCED threshold: > 15% height difference
-        # This will catch meaningful font changes while avoiding minor variations
-        height_diff_ratio = abs(avg_current_height - avg_prev_height) / max(avg_current_height, avg_prev_height)
-        return height_diff_ratio > 0.15
-    
-    return False
-
-def group_words_by_lines(words, y_tolerance=3):
-    """Group words into lines based on their vertical position."""
-    if not words:
-        return []
-    
-    # Sort words by vertical position first, then horizontal
-    sorted_words = sorted(words, key=lambda w: (w["top"], w["x0"]))
-    
-    lines = []
-    current_line = []
-    current_y = None
-    
-    for word in sorted_words:
-        word_y = word["top"]
-        
-        if current_y is None or abs(word_y - current_y) <= y_tolerance:
-            # Same line
-            current_line.append(word)
-            current_y = word_y if current_y is None else current_y
-        else:
-            # New line
-            if current_line:
-                # Sort current line by horizontal position
-                current_line.sort(key=lambda w: w["x0"])
-                lines.append(current_line)
-            current_line = [word]
-            current_y = word_y
-    
-    # Don't forget the last line
-    if current_line:
-        current_line.sort(key=lambda w: w["x0"])
-        lines.append(current_line)
-    
-    return lines
+# Process pool for document parsing - keeps CPU-heavy extraction off the GIL of
+# the serving process and isolates parser crashes. Created lazily on first use.
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
 
-def group_words_by_lines_converted(words, y_tolerance=3):
-    """Group words into lines based on their vertical position - for converted word objects."""
-    if not words:
-        return []
-    
-    # Sort words by vertical position first, then horizontal
-    sorted_words = sorted(words, key=lambda w: (w["y"], w["x"]))
-    
-    lines = []
-    current_line = []
-    current_y = None
-    
-    for word in sorted_words:
-        word_y = word["y"]
-        
-        if current_y is None or abs(word_y - current_y) <= y_tolerance:
-            # Same line
-            current_line.append(word)
-            current_y = word_y if current_y is None else current_y
-        else:
-            # New line
-            if current_line:
-                # Sort current line by horizontal position
-                current_line.sort(key=lambda w: w["x"])
-                lines.append(current_line)
-            current_line = [word]
-            current_y = word_y
-    
-    # Don't forget the last line
-    if current_line:
-        current_line.sort(key=lambda w: w["x"])
-        lines.append(current_line)
-    
-    return lines
-
-def _get_epub_content_items(book):
-    """Get content items from EPUB in spine order, handling all item types.
-    
-    Many EPUBs use text/html with .html extensions which ebooklib classifies as
-    ITEM_UNKNOWN rather than ITEM_DOCUMENT. We use the spine for reading order
-    and fall back to scanning all HTML-like items.
-    """
-    items_by_id = {}
-    items_by_name = {}
-    html_extensions = ('.xhtml', '.html', '.htm', '.xml')
-    html_media_types = ('application/xhtml+xml', 'text/html', 'application/html')
-
-    for item in book.get_items():
-        item_id = item.get_id() if hasattr(item, 'get_id') else None
-        item_name = item.get_name()
-        if item_id:
-            items_by_id[item_id] = item
-        if item_name:
-            items_by_name[item_name] = item
-
-    ordered = []
-    seen = set()
-    for spine_entry in book.spine:
-        item_id = spine_entry[0] if isinstance(spine_entry, (list, tuple)) else spine_entry
-        item = items_by_id.get(item_id)
-        if item and item.get_name() not in seen:
-            seen.add(item.get_name())
-            ordered.append(item)
-
-    if not ordered:
-        for item in book.get_items():
-            name = item.get_name()
-            media = getattr(item, 'media_type', '') or ''
-            is_html = any(name.lower().endswith(ext) for ext in html_extensions) or media in html_media_types
-            if is_html and name not in seen:
-                seen.add(name)
-                ordered.append(item)
+def get_extraction_pool():
+    """Get or create the shared extraction process pool (None when disabled)"""
+    global _extraction_pool
+    if Config.EXTRACTION_WORKERS <= 0:
+        return None
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            logger.info("Starting extraction pool with %s workers", Config.EXTRACTION_WORKERS)
+            # Never fork the threaded server process directly; forkserver children
+            # start from a clean single-threaded parent
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=Config.EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context(start_method)
+            )
+    return _extraction_pool
 
-    return ordered
+def _discard_extraction_pool(broken_pool):
+    """Drop a pool whose worker died so the next call starts a fresh one"""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is broken_pool:
+            _extraction_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
 
+def run_extraction(extractor, file_bytes):
+    """Run an extractor in the process pool, rebuilding the pool if a worker crashed"""
+    if Config.EXTRACTION_WORKERS <= 0:
+        return extractor(file_bytes)
+    
+    # A dead worker (crash or OOM kill) breaks the whole pool; retry once in a new one
+    for attempt in (1, 2):
+        pool = get_extraction_pool()
+        try:
+            return pool.submit(extractor, file_bytes).result()
+        except BrokenProcessPool:
+            logger.warning(f"⚠ Extraction worker died (attempt {attempt}), restarting pool")
+            _discard_extraction_pool(pool)
+    return None
 
-def extract_words_from_epub_bytes(file_bytes):
-    """Extract words and paragraph structure from EPUB bytes."""
-    all_words = []
-    global_word_index = 0
-    global_paragraph_id = 0
-    
-    try:
-        book = epub.read_epub(io.BytesIO(file_bytes))
-        content_items = _get_epub_content_items(book)
-        
-        chapter_num = 0
-        for item in content_items:
-            content = item.get_content()
-            soup = BeautifulSoup(content, 'lxml')
-            
-            body = soup.find('body')
-            if not body:
-                body = soup  # some fragments lack <body>
-            
-            body_text = body.get_text(strip=True)
-            if not body_text or len(body_text) < 10:
-                continue
-            
-            chapter_num += 1
-            
-            block_tags = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'blockquote']
-            paragraphs = body.find_all(block_tags)
-            
-            if not paragraphs:
-                divs = body.find_all('div')
-                paragraphs = [d for d in divs if d.string or (d.get_text(strip=True) and not d.find(block_tags))]
-            
-            if not paragraphs:
-                full_text = body.get_text(separator=' ', strip=True)
-                if full_text:
-                    class FakeParagraph:
-                        def __init__(self, t): self._t = t
-                        def get_text(self, strip=False): return self._t.strip() if strip else self._t
-                    paragraphs = [FakeParagraph(full_text)]
-            
-            seen_texts = set()
-            for p_tag in paragraphs:
-                text = p_tag.get_text(strip=True) if hasattr(p_tag, 'get_text') else str(p_tag)
-                text = re.sub(r'\s+', ' ', text).strip()
-                
-                if not text or len(text) < 2:
-                    continue
-                
-                if text in seen_texts:
-                    continue
-                seen_texts.add(text)
-                
-                words = text.split()
-                if not words:
-                    continue
-                
-                for i, word_text in enumerate(words):
-                    all_words.append({
-                        "text": word_text,
-                        "page": chapter_num,
-                        "index": global_word_index,
-                        "paragraph_id": global_paragraph_id,
-                        "paragraph_start": i == 0,
-                        "paragraph_end": i == len(words) - 1,
-                        "x": 0, "y": 0, "width": 0, "height": 0,
-                        "page_width": 0, "page_height": 0
-                    })
-                    global_word_index += 1
-                global_paragraph_id += 1
-        
-        logger.info(f"EPUB extraction: {len(all_words)} words from {chapter_num} chapters")
-        
-    except Exception as e:
-        logger.error(f"EPUB extraction failed: {e}")
-        traceback.print_exc()
+def extract_words_cached(file_bytes, is_epub):
+    """Extract words from PDF/EPUB bytes, reusing the result for identical uploads."""
+    key = (hashlib.sha256(file_bytes).hexdigest(), is_epub)
+    with _extraction_cache_lock:
+        if key in _extraction_cache:
+            _extraction_cache.move_to_end(key)
+            logger.info("Extraction cache hit for %s", key[0][:12])
+            return orjson.loads(_extraction_cache[key])
+    
+    extractor = extract_words_from_epub_bytes if is_epub else extract_words_from_pdf_bytes
+    words = run_extraction(extractor, file_bytes)
+    if words is None:
         return None
     
-    return all_words
+    words_blob = orjson.dumps(words, option=orjson.OPT_NON_STR_KEYS)
+    with _extraction_cache_lock:
+        _extraction_cache[key] = words_blob
+        while len(_extraction_cache) > Config.EXTRACTION_CACHE_SIZE:
+            _extraction_cache.popitem(last=False)
+    return words
 
 # Initialize Kokoro pipelines globally for better performance
 # Maintain separate pipelines for different language codes (EN-US 'a' and EN-GB 'b')
@@ -518,15 +138,15 @@ def get_kokoro_pipeline(lang_code='a'):
     """Get or initialize Kokoro pipeline (singleton pattern for performance)"""
     global kokoro_pipelines
     if lang_code not in kokoro_pipelines:
-        logger.info(f"Initializing Kokoro pipeline with lang_code: {lang_code}")
+        logger.info("Initializing Kokoro pipeline with lang_code: %s", lang_code)
         kokoro_pipelines[lang_code] = KPipeline(lang_code=lang_code)
-        logger.info(f"Kokoro pipeline for lang_code '{lang_code}' initialized successfully")
+        logger.info("Kokoro pipeline for lang_code '%s' initialized successfully", lang_code)
     return kokoro_pipelines[lang_code]
 
 def generate_audio_kokoro(text, voice_id, lang_code='a'):
     """Generate audio using Kokoro TTS"""
     try:
-        logger.info(f"Generating audio with Kokoro ({voice_id}) for text: {text[:50]}...")
+        logger.info("Generating audio with Kokoro (%s) for text: %s...", voice_id, text[:50])
         
         # Get or initialize pipeline
         pipeline = get_kokoro_pipeline(lang_code)
@@ -546,7 +166,7 @@ def generate_audio_kokoro(text, voice_id, lang_code='a'):
         # Kokoro outputs at 24kHz by default
         sample_rate = 24000
         
-        logger.info(f"Kokoro TTS completed: {len(audio_data)} samples at {sample_rate}Hz")
+        logger.info("Kokoro TTS completed: %s samples at %sHz", len(audio_data), sample_rate)
         return audio_data, sample_rate
         
     except Exception as e:
@@ -554,59 +174,6 @@ def generate_audio_kokoro(text, voice_id, lang_code='a'):
         traceback.print_exc()
         raise
 
-def has_significant_indentation_change(line_words, prev_line, main_text_margin):
-    """Detect significant indentation changes relative to main text alignment."""
-    if not prev_line or not line_words:
-        return False
-    
-    current_indent = line_words[0]["x0"]
-    prev_indent = prev_line[0]["x0"]
-    
-    # Check for significant deviation from main text margin
-    current_deviation = abs(current_indent - main_text_margin)
-    prev_deviation = abs(prev_indent - main_text_margin)
-    
-    # Significant indentation change: either line deviates significantly from main text
-    # OR there's a substantial change between the two lines
-    significant_deviation = current_deviation > 15 or prev_deviation > 15
-    substantial_change = abs(current_indent - prev_indent) > 20
-    
-    return significant_deviation or substantial_change
-
-def is_clear_paragraph_break(prev_line, current_line):
-    """Detect clear paragraph breaks for main-text-aligned lines."""
-    if not prev_line or not current_line:
-        return False
-    
-    prev_line_text = ' '.join(word["text"] for word in prev_line).strip()
-    current_line_text = ' '.join(word["text"] for word in current_line).strip()
-    
-    # Very strong paragraph ending indicators
-    strong_endings = ['.', '!', '?', ';"', '."', '!"', '?"']
-    ends_with_strong = any(prev_line_text.endswith(ending) for ending in strong_endings)
-    
-    # Strong paragraph starting indicators
-    strong_starts = ['Chapter', 'Section', 'Part', 'Book', 'Volume']
-    starts_with_strong = any(current_line_text.startswith(start) for start in strong_starts)
-    
-    # Check if current line starts with capital letter (potential new sentence/paragraph)
-    starts_with_capital = current_line_text and current_line_text[0].isupper()
-    
-    # Calculate line widths for additional context
-    page_width = max(max(word["x1"] for word in prev_line), max(word["x1"] for word in current_line))
-    prev_line_width = max(word["x1"] for word in prev_line) - min(word["x0"] for word in prev_line)
-    
-    # Previous line is quite short (likely end of paragraph)
-    prev_line_short = prev_line_width < page_width * 0.50
-    
-    # Clear paragraph break indicators:
-    # 1. Previous line ends with strong punctuation AND current starts with capital
-    # 2. Previous line is short AND current starts with capital
-    # 3. Current line starts with structural elements
-    return ((ends_with_strong and starts_with_capital) or
-            (prev_line_short and starts_with_capital and ends_with_strong) or
-            starts_with_strong)
-
 def detect_repeated_patterns(words):
     """Detect repeated patterns like headers, footers, and page numbers across the document."""
     if not words or len(words) < 50:  # Skip for very short documents
@@ -809,9 +376,8 @@ def detect_repeated_patterns(words):
     # Flatten patterns to get word indices for filtering
     patterns['total_filtered'] = sum(len(pattern_list) for pattern_list in patterns.values())
     
-    logger.info(f"Pattern detection found: {len(patterns['headers'])} header lines, "
-                f"{len(patterns['footers'])} footer lines, "
-                f"{len(patterns['page_numbers'])} page number lines")
+    logger.info("Pattern detection found: %s header lines, %s footer lines, %s page number lines",
+                len(patterns['headers']), len(patterns['footers']), len(patterns['page_numbers']))
     
     return patterns
 
@@ -820,7 +386,7 @@ def filter_patterns_from_words(words, skip_patterns=True):
     if not skip_patterns or not words:
         return words, {'total_filtered': 0}
     
-    logger.info(f"Starting pattern filtering on {len(words)} words")
+    logger.info("Starting pattern filtering on %s words", len(words))
     
     # Detect patterns
     patterns = detect_repeated_patterns(words)
@@ -861,7 +427,7 @@ def filter_patterns_from_words(words, skip_patterns=True):
             new_index += 1
     
     patterns['total_filtered'] = len(words_to_skip)
-    logger.info(f"Filtered {len(words_to_skip)} words from {len(words)} total words, result: {len(filtered_words)} words")
+    logger.info("Filtered %s words from %s total words, result: %s words", len(words_to_skip), len(words), len(filtered_words))
     
     # Verify no duplicates in filtered words
     indices = [w['index'] for w in filtered_words]
@@ -870,6 +436,11 @@ def filter_patterns_from_words(words, skip_patterns=True):
     
     return filtered_words, patterns
 
+def words_json_response(payload, words_blob):
+    """Build a JSON response around an already-serialized words array without re-encoding it"""
+    envelope = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return Response(envelope[:-1] + b',"words":' + words_blob + b'}', mimetype='application/json')
+
 # Authentication Routes
 @app.route('/')
 def index():
@@ -903,6 +474,8 @@ def auth_login():
             return jsonify({'error': 'Email and password are required'}), 400
         
         result = auth_service.authenticate_user(email, password)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
         if 'error' in result:
             return jsonify(result), 401
         
@@ -928,6 +501,8 @@ def auth_signup():
             return jsonify({'error': 'Password must be at least 6 characters'}), 400
         
         result = auth_service.create_user(email, password, name)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
         if 'error' in result:
             return jsonify(result), 400
         
@@ -961,9 +536,9 @@ def upload_file():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        filename_lower = file.filename.lower()
-        is_pdf = filename_lower.endswith('.pdf')
-        is_epub = filename_lower.endswith('.epub')
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        is_pdf = file_ext == '.pdf'
+        is_epub = file_ext == '.epub'
         
         if not is_pdf and not is_epub:
             return jsonify({'error': 'Please upload a PDF or EPUB file'}), 400
@@ -971,11 +546,10 @@ def upload_file():
         skip_patterns = request.form.get('skip_patterns', 'false').lower() == 'true'
         
         file_bytes = file.read()
+        if not has_valid_signature(file_bytes, is_epub):
+            return jsonify({'error': 'File content does not match its PDF/EPUB extension'}), 400
         
-        if is_epub:
-            words_data = extract_words_from_epub_bytes(file_bytes)
-        else:
-            words_data = extract_words_from_pdf_bytes(file_bytes)
+        words_data = extract_words_cached(file_bytes, is_epub)
         
         if words_data is None:
             return jsonify({'error': 'Could not extract words from file'}), 500
@@ -985,12 +559,14 @@ def upload_file():
         
         if skip_patterns and is_pdf:
             words_data, pattern_info = filter_patterns_from_words(words_data, skip_patterns=True)
-            logger.info(f"Pattern filtering: {pattern_info['total_filtered']} words filtered from {original_word_count}")
+            logger.info("Pattern filtering: %s words filtered from %s", pattern_info['total_filtered'], original_word_count)
         
         user_id = request.current_user['id']
         filename = secure_filename(file.filename)
         
-        pdf_result = auth_service.save_user_pdf(user_id, filename, file_bytes)
+        # Stream the upload to storage rather than writing the in-memory copy
+        file.stream.seek(0)
+        pdf_result = auth_service.save_user_pdf(user_id, filename, file.stream)
         if 'error' in pdf_result:
             logger.warning(f"Failed to save file to storage: {pdf_result['error']}")
         
@@ -999,7 +575,7 @@ def upload_file():
             file_id = pdf_result['pdf']['file_id']
             cache_result = auth_service.save_word_cache(user_id, file_id, words_data)
             if 'error' not in cache_result:
-                logger.info(f"Cached word data for uploaded file {file_id}: {len(words_data)} words")
+                logger.info("Cached word data for uploaded file %s: %s words", file_id, len(words_data))
         
         return jsonify({
             'words': words_data,
@@ -1032,14 +608,11 @@ def generate_audio():
         if len(text) > 10000:
             return jsonify({'error': 'Text too long for single request'}), 400
         
-        if model_key not in Config.AVAILABLE_MODELS:
+        voice_id, lang_code, voice_name = Config.MODEL_VOICES.get(model_key, (None, None, None))
+        if voice_id is None:
             return jsonify({'error': 'Invalid model selected'}), 400
         
-        voice_config = Config.AVAILABLE_MODELS[model_key]
-        voice_id = voice_config['voice_id']
-        lang_code = voice_config.get('lang_code', 'a')  # Default to American English
-        
-        logger.info(f"Generating audio with {voice_id} for {len(text)} characters")
+        logger.info("Generating audio with %s for %s characters", voice_id, len(text))
         
         audio_data, sample_rate = generate_audio_kokoro(text, voice_id, lang_code)
         
@@ -1049,7 +622,7 @@ def generate_audio():
         
         duration = len(audio_data) / sample_rate
         
-        logger.info(f"Generated audio: {duration:.2f}s, {len(audio_data)} samples")
+        logger.info("Generated audio: %.2fs, %s samples", duration, len(audio_data))
         
         return jsonify({
             'success': True,
@@ -1057,7 +630,7 @@ def generate_audio():
             'sample_rate': sample_rate,
             'duration': duration,
             'text': text,
-            'voice_used': voice_config['name']
+            'voice_used': voice_name
         })
         
     except Exception as e:
@@ -1112,11 +685,11 @@ def reading_progress_beacon():
         
         # Verify token manually since we can't use the decorator
         result = auth_service.verify_token(auth_token)
-        if 'error' in result:
+        if isinstance(result, tuple) or 'error' in result:
             return jsonify({'error': 'Invalid token'}), 401
         
         user_id = result['user']['id']
-        progress_data = json.loads(progress_data_str)
+        progress_data = app.json.loads(progress_data_str)
         
         pdf_id = progress_data.get('pdf_id')
         current_page = progress_data.get('current_page')
@@ -1160,19 +733,23 @@ def get_user_pdf_file(file_id):
         if 'error' in result:
             return jsonify(result), 404
         
-        file_data = result['file_data']
         metadata = result['metadata']
         
         content_type = 'application/pdf'
         if metadata['filename'].lower().endswith('.epub'):
             content_type = 'application/epub+zip'
         
-        response = make_response(file_data)
-        response.headers['Content-Type'] = content_type
-        response.headers['Content-Disposition'] = f'inline; filename="{metadata["filename"]}"'
-        response.headers['Content-Length'] = len(file_data)
-        
-        return response
+        # Stream from disk (sendfile via wsgi.file_wrapper) with Range/conditional support
+        try:
+            return send_file(
+                result['file_path'],
+                mimetype=content_type,
+                as_attachment=False,
+                download_name=metadata['filename'],
+                conditional=True
+            )
+        except FileNotFoundError:
+            return jsonify({'error': 'PDF file not found in storage'}), 404
         
     except Exception as e:
         logger.error(f"Error getting PDF file: {e}")
@@ -1184,7 +761,7 @@ def delete_user_pdf_file(file_id):
     """Delete PDF file and all associated data for the current user"""
     try:
         user_id = request.current_user['id']
-        logger.info(f"DELETE request for PDF {file_id} by user {user_id}")
+        logger.info("DELETE request for PDF %s by user %s", file_id, user_id)
         
         result = auth_service.delete_user_pdf(user_id, file_id)
         
@@ -1195,11 +772,11 @@ def delete_user_pdf_file(file_id):
         # Log the comprehensive cleanup results
         if 'deletion_summary' in result:
             summary = result['deletion_summary']
-            logger.info(f"Complete PDF deletion summary for {file_id}:")
-            logger.info(f"  - Local file: {'✓' if summary['local_file_deleted'] else '✗'}")
-            logger.info(f"  - Word cache: {'✓' if summary['word_cache_deleted'] else '✗'}")
-            logger.info(f"  - Reading progress: {'✓' if summary['reading_progress_deleted'] else '✗'} ({summary['progress_records_count']} records)")
-            logger.info(f"  - Metadata: {'✓' if summary['metadata_deleted'] else '✗'}")
+            logger.info("Complete PDF deletion summary for %s:", file_id)
+            logger.info("  - Local file: %s", '✓' if summary['local_file_deleted'] else '✗')
+            logger.info("  - Word cache: %s", '✓' if summary['word_cache_deleted'] else '✗')
+            logger.info("  - Reading progress: %s (%s records)", '✓' if summary['reading_progress_deleted'] else '✗', summary['progress_records_count'])
+            logger.info("  - Metadata: %s", '✓' if summary['metadata_deleted'] else '✗')
         
         return jsonify(result)
         
@@ -1223,12 +800,20 @@ def get_pdf_words(file_id):
             return jsonify(result), 500
         
         # Treat empty cached data as uncached so the frontend triggers re-extraction
-        if result.get('cached') and (not result.get('words') or len(result['words']) == 0):
-            result['cached'] = False
+        if not result.get('cached') or not result.get('word_count'):
+            return jsonify({
+                'success': True,
+                'words': [],
+                'cached': False,
+                'skip_patterns_enabled': False,
+                'patterns_filtered': 0
+            })
         
-        if skip_patterns and result.get('cached') and 'words' in result:
-            original_word_count = len(result['words'])
-            filtered_words, pattern_info = filter_patterns_from_words(result['words'], skip_patterns=True)
+        words_blob = result.pop('words_blob')
+        if skip_patterns:
+            words = orjson.loads(words_blob)
+            original_word_count = len(words)
+            filtered_words, pattern_info = filter_patterns_from_words(words, skip_patterns=True)
             
             result['words'] = filtered_words
             result['word_count'] = len(filtered_words)
@@ -1236,12 +821,13 @@ def get_pdf_words(file_id):
             result['patterns_filtered'] = pattern_info['total_filtered']
             result['skip_patterns_enabled'] = True
             
-            logger.info(f"Pattern filtering applied: {pattern_info['total_filtered']} words filtered from {original_word_count}")
-        else:
-            result['skip_patterns_enabled'] = False
-            result['patterns_filtered'] = 0
+            logger.info("Pattern filtering applied: %s words filtered from %s", pattern_info['total_filtered'], original_word_count)
+            return jsonify(result)
         
-        return jsonify(result)
+        # Unfiltered cache hits are sent as stored, without decoding the word list
+        result['skip_patterns_enabled'] = False
+        result['patterns_filtered'] = 0
+        return words_json_response(result, words_blob)
         
     except Exception as e:
         logger.error(f"Error getting PDF words: {e}")
@@ -1262,16 +848,22 @@ def extract_words_only():
         has_file = 'file' in request.files and request.files['file'].filename != ''
         if file_id and not has_file:
             cached_result = auth_service.get_cached_words(user_id, file_id)
-            if cached_result['cached'] and cached_result.get('words') and len(cached_result['words']) > 0:
-                logger.info(f"Using cached word data for file {file_id}")
+            if isinstance(cached_result, dict) and cached_result.get('cached') and cached_result.get('word_count'):
+                logger.info("Using cached word data for file %s", file_id)
                 
-                words_data = cached_result['words']
-                original_word_count = len(words_data)
-                pattern_info = {'total_filtered': 0}
+                original_word_count = cached_result['word_count']
+                if not skip_patterns:
+                    return words_json_response({
+                        'word_count': original_word_count,
+                        'original_word_count': original_word_count,
+                        'patterns_filtered': 0,
+                        'skip_patterns_enabled': False,
+                        'cached': True,
+                        'cached_at': cached_result['cached_at']
+                    }, cached_result['words_blob'])
                 
-                if skip_patterns:
-                    words_data, pattern_info = filter_patterns_from_words(words_data, skip_patterns=True)
-                    logger.info(f"Pattern filtering on cached data: {pattern_info['total_filtered']} words filtered from {original_word_count}")
+                words_data, pattern_info = filter_patterns_from_words(orjson.loads(cached_result['words_blob']), skip_patterns=True)
+                logger.info("Pattern filtering on cached data: %s words filtered from %s", pattern_info['total_filtered'], original_word_count)
                 
                 return jsonify({
                     'words': words_data,
@@ -1291,15 +883,16 @@ def extract_words_only():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        filename_lower = file.filename.lower()
-        if not filename_lower.endswith('.pdf') and not filename_lower.endswith('.epub'):
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        is_epub = file_ext == '.epub'
+        if file_ext != '.pdf' and not is_epub:
             return jsonify({'error': 'Please upload a PDF or EPUB file'}), 400
         
         file_bytes = file.read()
-        if filename_lower.endswith('.epub'):
-            words_data = extract_words_from_epub_bytes(file_bytes)
-        else:
-            words_data = extract_words_from_pdf_bytes(file_bytes)
+        if not has_valid_signature(file_bytes, is_epub):
+            return jsonify({'error': 'File content does not match its PDF/EPUB extension'}), 400
+        
+        words_data = extract_words_cached(file_bytes, is_epub)
         
         if words_data is None:
             return jsonify({'error': 'Could not extract words from file'}), 500
@@ -1310,18 +903,18 @@ def extract_words_only():
         
         if skip_patterns:
             words_data, pattern_info = filter_patterns_from_words(words_data, skip_patterns=True)
-            logger.info(f"Pattern filtering on new extraction: {pattern_info['total_filtered']} words filtered from {original_word_count}")
+            logger.info("Pattern filtering on new extraction: %s words filtered from %s", pattern_info['total_filtered'], original_word_count)
         
         # Cache the results if file_id is provided (cache the original unfiltered data)
         if file_id:
             # Always cache the original unfiltered data so we can apply different filtering later
             if skip_patterns:
-                original_words = extract_words_from_epub_bytes(file_bytes) if filename_lower.endswith('.epub') else extract_words_from_pdf_bytes(file_bytes)
+                original_words = extract_words_cached(file_bytes, is_epub)
             else:
                 original_words = words_data
             cache_result = auth_service.save_word_cache(user_id, file_id, original_words)
             if 'error' not in cache_result:
-                logger.info(f"Cached word data for file {file_id}: {len(original_words)} words")
+                logger.info("Cached word data for file %s: %s words", file_id, len(original_words))
         
         return jsonify({
             'words': words_data,
@@ -1385,7 +978,7 @@ def upload_background_music():
         if 'error' in result:
             return jsonify(result), 400
         
-        logger.info(f"Background music uploaded: {result['file_id']} by user {user_id}")
+        logger.info("Background music uploaded: %s by user %s", result['file_id'], user_id)
         return jsonify(result)
         
     except Exception as e:
@@ -1403,7 +996,6 @@ def get_background_music_file(file_id):
         if 'error' in result:
             return jsonify(result), 404
         
-        file_data = result['file_data']
         metadata = result['metadata']
         
         # Determine content type based on file extension
@@ -1418,12 +1010,17 @@ def get_background_music_file(file_id):
         }
         content_type = content_type_map.get(file_ext, 'audio/mpeg')
         
-        response = make_response(file_data)
-        response.headers['Content-Type'] = content_type
-        response.headers['Content-Disposition'] = f'inline; filename="{metadata["filename"]}"'
-        response.headers['Content-Length'] = len(file_data)
-        
-        return response
+        # Stream from disk with Range support so audio seeking only reads the needed bytes
+        try:
+            return send_file(
+                result['file_path'],
+                mimetype=content_type,
+                as_attachment=False,
+                download_name=metadata['filename'],
+                conditional=True
+            )
+        except FileNotFoundError:
+            return jsonify({'error': 'Background music file not found in storage'}), 404
         
     except Exception as e:
         logger.error(f"Error getting background music file: {e}")
@@ -1435,7 +1032,7 @@ def delete_background_music_file(file_id):
     """Delete background music file for the current user"""
     try:
         user_id = request.current_user['id']
-        logger.info(f"DELETE request for background music {file_id} by user {user_id}")
+        logger.info("DELETE request for background music %s by user %s", file_id, user_id)
         
         result = auth_service.delete_background_music(user_id, file_id)
         
@@ -1443,7 +1040,7 @@ def delete_background_music_file(file_id):
             logger.warning(f"Delete failed for background music {file_id}: {result['error']}")
             return jsonify(result), 404
         
-        logger.info(f"Background music deleted: {file_id} by user {user_id}")
+        logger.info("Background music deleted: %s by user %s", file_id, user_id)
         return jsonify(result)
         
     except Exception as e:
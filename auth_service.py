@@ -1,10 +1,17 @@
 import os
+import shutil
 import jwt
-import bcrypt
 import uuid
-import json
-from datetime import datetime, timedelta
-from supabase import create_client, Client
+import time
+import atexit
+import threading
+from collections import OrderedDict
+import orjson
+import zstandard as zstd
+import fastjsonschema
+from datetime import datetime, timedelta, timezone
+import httpx
+from supabase import create_client, Client, ClientOptions
 from functools import wraps
 from flask import request, jsonify, current_app
 from config import Config
@@ -12,6 +19,47 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Buffer size for writing uploaded files to local storage
+WRITE_BUFFER_SIZE = 256 * 1024
+# Chunk size for copying upload streams when sendfile is unavailable
+COPY_CHUNK_SIZE = 1024 * 1024
+# Uploads above this size are written in unbuffered chunks and evicted from the page cache
+LARGE_FILE_THRESHOLD = 16 * 1024 * 1024
+
+# zstd level for word caches - level 3 compresses well and decodes at >1 GB/s
+WORD_CACHE_ZSTD_LEVEL = 3
+
+# Preference payload schemas, compiled once into plain Python validators
+USER_PREFERENCES_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'voice_model': {'type': 'string'},
+        'voice_speed': {'type': 'number', 'minimum': 0.1, 'maximum': 5.0},
+        'skip_patterns': {'type': 'boolean'}
+    }
+}
+BOOK_PREFERENCES_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'voice_model': {'type': ['string', 'null']},
+        'voice_speed': {'type': ['number', 'null'], 'minimum': 0.1, 'maximum': 5.0},
+        'skip_patterns': {'type': ['boolean', 'null']},
+        'background_music_enabled': {'type': 'boolean'},
+        'background_music_file_id': {'type': ['string', 'null']},
+        'background_music_volume': {'type': 'number', 'minimum': 0.0, 'maximum': 1.0}
+    }
+}
+validate_user_preferences = fastjsonschema.compile(USER_PREFERENCES_SCHEMA)
+validate_book_preferences = fastjsonschema.compile(BOOK_PREFERENCES_SCHEMA)
+
+# PostgREST error code for a call to a database function that doesn't exist
+MISSING_FUNCTION_CODE = 'PGRST202'
+
+
+def _is_missing_function(error):
+    """True if a Supabase RPC failed because the function isn't in the schema"""
+    return getattr(error, 'code', None) == MISSING_FUNCTION_CODE
+
 class AuthService:
     def __init__(self):
         # Set up local storage directory
@@ -22,13 +70,55 @@ class AuthService:
         self.music_storage_path = os.environ.get('MUSIC_STORAGE_PATH', './music_storage')
         os.makedirs(self.music_storage_path, exist_ok=True)
         
+        # Per-user storage directories already created by this process
+        self._ensured_dirs = set()
+        
+        # In-memory LRU of parsed word caches keyed by (user_id, file_id, mtime_ns)
+        self._word_cache_mem = OrderedDict()
+        self._word_cache_lock = threading.Lock()
+        
+        # JWT signing key encoded once instead of on every encode/decode
+        self._jwt_key = Config.JWT_SECRET_KEY.encode('utf-8')
+        
+        # PDF metadata rows per user (user_id -> file_id -> row). Only changes on
+        # upload/delete, which update it in the same step as the database write.
+        self._pdf_meta_cache = {}
+        self._pdf_meta_lock = threading.Lock()
+        
+        # Short-lived cache of user profiles for verify_token: user_id -> (fetched_at, row)
+        self._user_cache = {}
+        
+        # Recently verified tokens: token -> (exp, result), so repeat requests skip the decode
+        self._token_cache = OrderedDict()
+        self._token_lock = threading.Lock()
+        
+        # Preferences per user: user_id -> {(kind, pdf_id): (fetched_at, preferences)}.
+        # A write drops the whole user entry in this process; other workers see the change
+        # once their copy is older than PREFERENCES_CACHE_TTL.
+        self._prefs_cache = {}
+        self._prefs_lock = threading.Lock()
+        
+        # Pending reading progress writes keyed by (user_id, pdf_id), latest wins.
+        # Flushed to the database in one upsert every PROGRESS_FLUSH_INTERVAL seconds.
+        self._progress_dirty = {}
+        self._progress_lock = threading.Lock()
+        self._progress_timer = None
+        atexit.register(self.flush_reading_progress)
+        
+        # Table request builders on the admin client, created on first use
+        self._table_handles = {}
+        
+        # Keep-alive HTTP clients handed to Supabase, closed on shutdown
+        self._http_clients = []
+        atexit.register(self._close_http_clients)
+        
         if Config.SUPABASE_URL and Config.SUPABASE_ANON_KEY and Config.SUPABASE_URL != '' and Config.SUPABASE_ANON_KEY != '':
             try:
                 # Use anon key for auth operations
-                self.supabase: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_ANON_KEY)
+                self.supabase: Client = self._create_supabase_client(Config.SUPABASE_ANON_KEY)
                 # Use service role key for database operations (bypasses RLS)
                 if Config.SUPABASE_SERVICE_ROLE_KEY:
-                    self.supabase_admin: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_SERVICE_ROLE_KEY)
+                    self.supabase_admin: Client = self._create_supabase_client(Config.SUPABASE_SERVICE_ROLE_KEY)
                 else:
                     self.supabase_admin = self.supabase
                 logger.info("Supabase client initialized successfully")
@@ -41,54 +131,233 @@ class AuthService:
             self.supabase = None
             self.supabase_admin = None
 
+    def _create_supabase_client(self, key: str):
+        """Create a Supabase client backed by a pooled keep-alive HTTP/2 connection.
+        
+        Each client gets its own httpx.Client because the Supabase libraries set their
+        API key headers on the session, so sharing one would mix anon and service keys.
+        """
+        http_client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=Config.SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.SUPABASE_MAX_KEEPALIVE,
+                keepalive_expiry=Config.SUPABASE_KEEPALIVE_EXPIRY
+            ),
+            timeout=10.0
+        )
+        try:
+            options = ClientOptions(httpx_client=http_client)
+        except TypeError:
+            # Older supabase-py without httpx_client injection - keep its own session
+            http_client.close()
+            return create_client(Config.SUPABASE_URL, key)
+        self._http_clients.append(http_client)
+        return create_client(Config.SUPABASE_URL, key, options=options)
+
+    def _table(self, name: str):
+        """Return a reusable request builder for a table on the admin client.
+        
+        The builders are stateless (each select/insert/update starts a new query),
+        so one per table is created and shared instead of one per call.
+        """
+        handle = self._table_handles.get(name)
+        if handle is None:
+            handle = self._table_handles[name] = self.supabase_admin.table(name)
+        return handle
+
+    def _close_http_clients(self):
+        """Close pooled HTTP connections on shutdown"""
+        for http_client in self._http_clients:
+            http_client.close()
+
+    def _ensure_dir(self, path: str):
+        """Create a directory once per process, skipping the mkdir syscall afterwards"""
+        if path not in self._ensured_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._ensured_dirs.add(path)
+        return path
+
     def _get_user_storage_path(self, user_id: str):
         """Get the local storage path for a specific user"""
-        user_path = os.path.join(self.local_storage_path, user_id)
-        os.makedirs(user_path, exist_ok=True)
-        return user_path
+        return self._ensure_dir(os.path.join(self.local_storage_path, user_id))
 
     def _get_user_music_storage_path(self, user_id: str):
         """Get the local music storage path for a specific user"""
-        user_music_path = os.path.join(self.music_storage_path, user_id)
-        os.makedirs(user_music_path, exist_ok=True)
-        return user_music_path
+        return self._ensure_dir(os.path.join(self.music_storage_path, user_id))
 
     def _get_cache_file_path(self, user_id: str, file_id: str):
-        """Get the cache file path for PDF word data"""
+        """Get the cache file path for PDF word data (zstd-compressed JSON array)"""
+        user_storage_path = self._get_user_storage_path(user_id)
+        return os.path.join(user_storage_path, f"{file_id}_words.json.zst")
+
+    def _get_cache_meta_path(self, user_id: str, file_id: str):
+        """Get the path of the small metadata file written alongside the word cache"""
+        user_storage_path = self._get_user_storage_path(user_id)
+        return os.path.join(user_storage_path, f"{file_id}_meta.json")
+
+    def _get_legacy_cache_file_path(self, user_id: str, file_id: str):
+        """Get the path of the original single-file JSON word cache"""
         user_storage_path = self._get_user_storage_path(user_id)
         return os.path.join(user_storage_path, f"{file_id}_words.json")
 
-    def _save_word_cache(self, user_id: str, file_id: str, word_data: list):
-        """Save extracted word data to cache file"""
+    def _drop_from_page_cache(self, fd: int):
+        """Flush a large file to disk and advise the kernel not to keep it cached"""
+        os.fdatasync(fd)
         try:
-            cache_file_path = self._get_cache_file_path(user_id, file_id)
-            cache_data = {
-                'word_data': word_data,
-                'cached_at': datetime.utcnow().isoformat(),
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except AttributeError:
+            pass
+
+    def _write_local_file(self, file_path: str, file_data: bytes):
+        """Write an uploaded file to local storage with a large write buffer"""
+        if len(file_data) <= LARGE_FILE_THRESHOLD:
+            with open(file_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                f.write(file_data)
+            return
+        
+        # Large files skip Python buffering and go straight to the fd in 1 MiB chunks
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(file_data)
+            offset = 0
+            while offset < len(view):
+                offset += os.write(fd, view[offset:offset + COPY_CHUNK_SIZE])
+            self._drop_from_page_cache(fd)
+        finally:
+            os.close(fd)
+
+    def _write_file_atomic(self, file_path: str, data: bytes):
+        """Write a file via a temp file and rename, so readers never see a partial write"""
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _read_local_file(self, file_path: str):
+        """Read a whole file with one unbuffered, fstat-sized read"""
+        with open(file_path, 'rb', buffering=0) as f:
+            return f.read(os.fstat(f.fileno()).st_size)
+
+    def _copy_stream_to_local_file(self, file_path: str, src_stream):
+        """Copy an upload stream to local storage and return the number of bytes written.
+        
+        Uses sendfile when the stream is backed by a real file (Werkzeug spools large
+        uploads to a temp file), otherwise falls back to a chunked copy.
+        """
+        with open(file_path, 'wb', buffering=0) as dst:
+            try:
+                src_fd = src_stream.fileno()
+                offset = src_stream.tell()
+                remaining = os.fstat(src_fd).st_size - offset
+                while remaining > 0:
+                    sent = os.sendfile(dst.fileno(), src_fd, offset, remaining)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+            except (AttributeError, OSError):
+                # io.UnsupportedOperation (in-memory streams) is an OSError subclass
+                dst.seek(0)
+                dst.truncate()
+                shutil.copyfileobj(src_stream, dst, COPY_CHUNK_SIZE)
+            bytes_written = dst.tell()
+            if bytes_written > LARGE_FILE_THRESHOLD:
+                self._drop_from_page_cache(dst.fileno())
+            return bytes_written
+
+    def _evict_word_cache_mem(self, user_id: str, file_id: str):
+        """Drop in-memory copies of a file's word cache"""
+        with self._word_cache_lock:
+            for key in [k for k in self._word_cache_mem if k[0] == user_id and k[1] == file_id]:
+                del self._word_cache_mem[key]
+
+    def _save_word_cache(self, user_id: str, file_id: str, word_data: list, cached_at: str = None):
+        """Save extracted word data to cache files.
+        
+        The word list is stored pre-serialized as JSON so cache hits can be sent to
+        the client without decoding and re-encoding; count and timestamp live in a
+        separate small metadata file that is written last.
+        """
+        try:
+            words_blob = orjson.dumps(word_data, option=orjson.OPT_NON_STR_KEYS)
+            meta = {
+                'cached_at': cached_at or datetime.utcnow().isoformat(),
                 'word_count': len(word_data)
             }
             
-            with open(cache_file_path, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            self._evict_word_cache_mem(user_id, file_id)
+            self._write_file_atomic(
+                self._get_cache_file_path(user_id, file_id),
+                zstd.ZstdCompressor(level=WORD_CACHE_ZSTD_LEVEL).compress(words_blob)
+            )
+            self._write_file_atomic(self._get_cache_meta_path(user_id, file_id), orjson.dumps(meta))
             
-            logger.info(f"Cached word data for file {file_id}: {len(word_data)} words")
+            logger.info("Cached word data for file %s: %s words", file_id, len(word_data))
             return True
         except Exception as e:
             logger.error(f"Error saving word cache: {e}")
             return False
 
+    def _load_legacy_word_cache(self, user_id: str, file_id: str):
+        """Load a word cache in the original single-file JSON format and rewrite it in the current one"""
+        cache_file_path = self._get_legacy_cache_file_path(user_id, file_id)
+        try:
+            legacy_data = orjson.loads(self._read_local_file(cache_file_path))
+        except FileNotFoundError:
+            return None
+        
+        word_data = legacy_data['word_data']
+        if self._save_word_cache(user_id, file_id, word_data, cached_at=legacy_data['cached_at']):
+            os.remove(cache_file_path)
+        return {
+            'words_blob': orjson.dumps(word_data, option=orjson.OPT_NON_STR_KEYS),
+            'cached_at': legacy_data['cached_at'],
+            'word_count': legacy_data['word_count']
+        }
+
     def _load_word_cache(self, user_id: str, file_id: str):
-        """Load cached word data if available"""
+        """Load cached word data as {'words_blob', 'cached_at', 'word_count'} if available"""
         try:
-            cache_file_path = self._get_cache_file_path(user_id, file_id)
-            
-            if not os.path.exists(cache_file_path):
-                return None
+            meta_path = self._get_cache_meta_path(user_id, file_id)
+            try:
+                mtime_ns = os.stat(meta_path).st_mtime_ns
+            except FileNotFoundError:
+                return self._load_legacy_word_cache(user_id, file_id)
+            
+            # Serve from memory while the file on disk is unchanged
+            mem_key = (user_id, file_id, mtime_ns)
+            with self._word_cache_lock:
+                cache_data = self._word_cache_mem.get(mem_key)
+                if cache_data is not None:
+                    self._word_cache_mem.move_to_end(mem_key)
+                    return cache_data
+            
+            meta = orjson.loads(self._read_local_file(meta_path))
+            words_blob = zstd.ZstdDecompressor().decompress(
+                self._read_local_file(self._get_cache_file_path(user_id, file_id))
+            )
+            cache_data = {
+                'words_blob': words_blob,
+                'cached_at': meta['cached_at'],
+                'word_count': meta['word_count']
+            }
             
-            with open(cache_file_path, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
+            with self._word_cache_lock:
+                self._word_cache_mem[mem_key] = cache_data
+                while len(self._word_cache_mem) > Config.WORD_CACHE_MEMORY_SIZE:
+                    self._word_cache_mem.popitem(last=False)
             
-            logger.info(f"Loaded cached word data for file {file_id}: {cache_data.get('word_count', 0)} words")
+            logger.info("Loaded cached word data for file %s: %s words", file_id, cache_data['word_count'])
             return cache_data
         except Exception as e:
             logger.error(f"Error loading word cache: {e}")
@@ -97,24 +366,37 @@ class AuthService:
     def _delete_word_cache(self, user_id: str, file_id: str):
         """Delete cached word data"""
         try:
-            cache_file_path = self._get_cache_file_path(user_id, file_id)
-            if os.path.exists(cache_file_path):
-                os.remove(cache_file_path)
-                logger.info(f"Deleted word cache for file {file_id}")
-                return True
-            return False
+            self._evict_word_cache_mem(user_id, file_id)
+            cache_paths = [
+                self._get_cache_meta_path(user_id, file_id),
+                self._get_cache_file_path(user_id, file_id),
+                self._get_legacy_cache_file_path(user_id, file_id)
+            ]
+            deleted = False
+            for cache_file_path in cache_paths:
+                try:
+                    os.remove(cache_file_path)
+                    deleted = True
+                except FileNotFoundError:
+                    pass
+            if deleted:
+                logger.info("Deleted word cache for file %s", file_id)
+            return deleted
         except Exception as e:
             logger.error(f"Error deleting word cache: {e}")
             return False
 
     def get_cached_words(self, user_id: str, file_id: str):
-        """Get cached word data for a PDF file"""
+        """Get cached word data for a PDF file.
+        
+        Cache hits return the words as a pre-serialized JSON array in 'words_blob'.
+        """
         try:
             cache_data = self._load_word_cache(user_id, file_id)
             if cache_data:
                 return {
                     'success': True,
-                    'words': cache_data['word_data'],
+                    'words_blob': cache_data['words_blob'],
                     'cached': True,
                     'cached_at': cache_data['cached_at'],
                     'word_count': cache_data['word_count']
@@ -141,8 +423,8 @@ class AuthService:
             logger.error(f"Error saving word cache: {e}")
             return {'error': str(e)}, 500
 
-    def _save_pdf_to_local_storage(self, user_id: str, filename: str, file_data: bytes):
-        """Save PDF file to local storage"""
+    def _save_pdf_to_local_storage(self, user_id: str, filename: str, src_stream):
+        """Stream PDF file to local storage"""
         try:
             user_storage_path = self._get_user_storage_path(user_id)
             
@@ -152,33 +434,23 @@ class AuthService:
             local_filename = f"{file_id}{file_extension}"
             file_path = os.path.join(user_storage_path, local_filename)
             
-            # Write file to disk
-            with open(file_path, 'wb') as f:
-                f.write(file_data)
+            # Stream file to disk
+            file_size = self._copy_stream_to_local_file(file_path, src_stream)
             
             return {
                 'file_id': file_id,
                 'local_filename': local_filename,
-                'file_path': file_path
+                'file_path': file_path,
+                'file_size': file_size
             }
         except Exception as e:
             logger.error(f"Error saving PDF to local storage: {e}")
             raise
 
-    def _get_pdf_from_local_storage(self, user_id: str, file_id: str, filename: str):
-        """Get PDF file from local storage"""
-        try:
-            user_storage_path = self._get_user_storage_path(user_id)
-            file_path = os.path.join(user_storage_path, filename)
-            
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    return f.read()
-            else:
-                return None
-        except Exception as e:
-            logger.error(f"Error getting PDF from local storage: {e}")
-            return None
+    def _get_pdf_path_for_user(self, user_id: str, filename: str):
+        """Get the absolute path of a stored PDF (existence is checked when it is opened)"""
+        user_storage_path = self._get_user_storage_path(user_id)
+        return os.path.abspath(os.path.join(user_storage_path, filename))
 
     def _delete_pdf_from_local_storage(self, user_id: str, filename: str):
         """Delete PDF file from local storage"""
@@ -186,10 +458,11 @@ class AuthService:
             user_storage_path = self._get_user_storage_path(user_id)
             file_path = os.path.join(user_storage_path, filename)
             
-            if os.path.exists(file_path):
+            try:
                 os.remove(file_path)
                 return True
-            return False
+            except FileNotFoundError:
+                return False
         except Exception as e:
             logger.error(f"Error deleting PDF from local storage: {e}")
             return False
@@ -218,7 +491,7 @@ class AuthService:
                     'created_at': datetime.utcnow().isoformat()
                 }
                 
-                self.supabase_admin.table('users').insert(user_data).execute()
+                self._table('users').insert(user_data).execute()
                 
                 return {
                     'success': True,
@@ -249,7 +522,7 @@ class AuthService:
             
             if response.user and response.session:
                 # Get user profile
-                user_profile = self.supabase_admin.table('users').select('*').eq('id', response.user.id).execute()
+                user_profile = self._table('users').select('*').eq('id', response.user.id).execute()
                 
                 if user_profile.data:
                     user_data = user_profile.data[0]
@@ -258,10 +531,11 @@ class AuthService:
                     token_payload = {
                         'user_id': response.user.id,
                         'email': response.user.email,
+                        'name': user_data['name'],
                         'exp': datetime.utcnow() + timedelta(seconds=Config.JWT_ACCESS_TOKEN_EXPIRES)
                     }
                     
-                    token = jwt.encode(token_payload, Config.JWT_SECRET_KEY, algorithm='HS256')
+                    token = jwt.encode(token_payload, self._jwt_key, algorithm='HS256')
                     
                     return {
                         'success': True,
@@ -283,18 +557,40 @@ class AuthService:
 
     def verify_token(self, token: str):
         """Verify JWT token and return user data"""
+        with self._token_lock:
+            exp, cached_result = self._token_cache.get(token, (0, None))
+            if cached_result is not None and time.time() < exp:
+                self._token_cache.move_to_end(token)
+                return cached_result
+        
         try:
-            payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
+            payload = jwt.decode(token, self._jwt_key, algorithms=['HS256'])
             user_id = payload.get('user_id')
             
             if user_id:
-                # Get user profile
-                user_profile = self.supabase_admin.table('users').select('*').eq('id', user_id).execute()
+                # Tokens carry the profile fields routes need, so no database lookup
+                if 'name' in payload:
+                    result = {
+                        'success': True,
+                        'user': {
+                            'id': user_id,
+                            'email': payload.get('email'),
+                            'name': payload['name']
+                        }
+                    }
+                    if 'exp' in payload:
+                        with self._token_lock:
+                            self._token_cache[token] = (payload['exp'], result)
+                            while len(self._token_cache) > Config.TOKEN_CACHE_SIZE:
+                                self._token_cache.popitem(last=False)
+                    return result
                 
-                if user_profile.data:
+                # Tokens issued before the name claim was added fall back to the profile row
+                user_row = self.get_user_profile(user_id)
+                if user_row:
                     return {
                         'success': True,
-                        'user': user_profile.data[0]
+                        'user': user_row
                     }
             
             return {'error': 'Invalid token'}, 401
@@ -304,23 +600,73 @@ class AuthService:
         except jwt.InvalidTokenError:
             return {'error': 'Invalid token'}, 401
 
+    def get_user_profile(self, user_id: str):
+        """Get the full users row for a user, or None if it does not exist"""
+        # Reuse a recently fetched profile to skip the database round-trip
+        fetched_at, user_row = self._user_cache.get(user_id, (0.0, None))
+        if user_row and time.monotonic() - fetched_at < Config.USER_CACHE_TTL:
+            return user_row
+        
+        user_profile = self._table('users').select('*').eq('id', user_id).execute()
+        
+        if user_profile.data:
+            self._user_cache[user_id] = (time.monotonic(), user_profile.data[0])
+            return user_profile.data[0]
+        return None
+
+    def _get_cached_preferences(self, user_id: str, key: tuple):
+        """Return (True, preferences) if a fresh cached copy exists, otherwise (False, None)"""
+        with self._prefs_lock:
+            fetched_at, prefs = self._prefs_cache.get(user_id, {}).get(key, (None, None))
+        if fetched_at is not None and time.monotonic() - fetched_at < Config.PREFERENCES_CACHE_TTL:
+            return True, prefs
+        return False, None
+
+    def _cache_preferences(self, user_id: str, key: tuple, prefs):
+        """Remember preferences for later lookups"""
+        with self._prefs_lock:
+            self._prefs_cache.setdefault(user_id, {})[key] = (time.monotonic(), prefs)
+
+    def _invalidate_preferences(self, user_id: str):
+        """Drop all cached preferences for a user after a write"""
+        with self._prefs_lock:
+            self._prefs_cache.pop(user_id, None)
+
+    def _cache_pdf_metadata(self, user_id: str, rows: list):
+        """Remember PDF metadata rows for later file lookups"""
+        with self._pdf_meta_lock:
+            user_meta = self._pdf_meta_cache.setdefault(user_id, {})
+            for row in rows:
+                user_meta[row['file_id']] = row
+
+    def _get_cached_pdf_metadata(self, user_id: str, file_id: str):
+        """Get a cached PDF metadata row, or None if it is not cached"""
+        with self._pdf_meta_lock:
+            return self._pdf_meta_cache.get(user_id, {}).get(file_id)
+
+    def _evict_pdf_metadata(self, user_id: str, file_id: str):
+        """Forget a PDF's cached metadata"""
+        with self._pdf_meta_lock:
+            self._pdf_meta_cache.get(user_id, {}).pop(file_id, None)
+
     def get_user_pdfs(self, user_id: str):
         """Get all PDFs for a specific user"""
         try:
-            pdfs = self.supabase_admin.table('user_pdfs').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
+            pdfs = self._table('user_pdfs').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
+            self._cache_pdf_metadata(user_id, pdfs.data)
             return {'success': True, 'pdfs': pdfs.data}
         except Exception as e:
             logger.error(f"Error getting user PDFs: {e}")
             return {'error': str(e)}, 500
 
-    def save_user_pdf(self, user_id: str, filename: str, file_data: bytes):
-        """Save PDF file locally and metadata in database"""
+    def save_user_pdf(self, user_id: str, filename: str, src_stream):
+        """Save PDF file locally from an upload stream and metadata in database"""
         try:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
             # Save file to local storage
-            storage_result = self._save_pdf_to_local_storage(user_id, filename, file_data)
+            storage_result = self._save_pdf_to_local_storage(user_id, filename, src_stream)
             
             # Save PDF metadata to database (without file content)
             pdf_data = {
@@ -328,11 +674,12 @@ class AuthService:
                 'filename': filename,
                 'file_id': storage_result['file_id'],
                 'local_filename': storage_result['local_filename'],
-                'file_size': len(file_data),
+                'file_size': storage_result['file_size'],
                 'created_at': datetime.utcnow().isoformat()
             }
             
-            db_response = self.supabase_admin.table('user_pdfs').insert(pdf_data).execute()
+            db_response = self._table('user_pdfs').insert(pdf_data).execute()
+            self._cache_pdf_metadata(user_id, db_response.data)
             return {'success': True, 'pdf': db_response.data[0]}
                 
         except Exception as e:
@@ -340,28 +687,28 @@ class AuthService:
             return {'error': str(e)}, 500
 
     def get_user_pdf_file(self, user_id: str, file_id: str):
-        """Get PDF file content from local storage"""
+        """Get the local storage path and metadata of a PDF file"""
         try:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
-            # Get PDF metadata from database
-            pdf_record = self.supabase_admin.table('user_pdfs').select('*').eq('user_id', user_id).eq('file_id', file_id).execute()
-            
-            if not pdf_record.data:
-                return {'error': 'PDF not found'}, 404
-            
-            pdf_metadata = pdf_record.data[0]
-            
-            # Get file content from local storage
-            file_data = self._get_pdf_from_local_storage(user_id, file_id, pdf_metadata['local_filename'])
+            # Get PDF metadata, from the cache when possible
+            pdf_metadata = self._get_cached_pdf_metadata(user_id, file_id)
+            if pdf_metadata is None:
+                pdf_record = self._table('user_pdfs').select('*').eq('user_id', user_id).eq('file_id', file_id).execute()
+                
+                if not pdf_record.data:
+                    return {'error': 'PDF not found'}, 404
+                
+                pdf_metadata = pdf_record.data[0]
+                self._cache_pdf_metadata(user_id, pdf_record.data)
             
-            if file_data is None:
-                return {'error': 'PDF file not found in storage'}, 404
+            # Resolve the file in local storage - the route streams it from disk
+            file_path = self._get_pdf_path_for_user(user_id, pdf_metadata['local_filename'])
             
             return {
                 'success': True,
-                'file_data': file_data,
+                'file_path': file_path,
                 'metadata': pdf_metadata
             }
         except Exception as e:
@@ -374,97 +721,60 @@ class AuthService:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
-            # Get PDF metadata
-            pdf_record = self.supabase_admin.table('user_pdfs').select('*').eq('user_id', user_id).eq('file_id', file_id).execute()
+            self._discard_pending_progress(user_id, file_id)
+            logger.info("Starting deletion of PDF %s for user %s", file_id, user_id)
             
-            if not pdf_record.data:
-                return {'error': 'PDF not found'}, 404
+            # 1. Delete reading progress and metadata in a single transactional RPC
+            try:
+                try:
+                    pdf_metadata = self.supabase_admin.rpc('delete_user_pdf', {'p_user': user_id, 'p_file': file_id}).execute().data
+                except Exception as rpc_error:
+                    if not _is_missing_function(rpc_error):
+                        raise
+                    # Database predates the delete_user_pdf function
+                    logger.warning("⚠ delete_user_pdf function missing, deleting rows individually")
+                    pdf_metadata = self._delete_user_pdf_rows(user_id, file_id)
+            except Exception as db_error:
+                logger.error(f"✗ Failed to delete PDF metadata: {db_error}")
+                return {'error': f'Database deletion failed: {str(db_error)}'}, 500
             
-            pdf_metadata = pdf_record.data[0]
-            logger.info(f"Starting deletion of PDF: {pdf_metadata['filename']} (ID: {file_id}) for user {user_id}")
+            self._evict_pdf_metadata(user_id, file_id)
+            # book_preferences rows cascade with the PDF
+            self._invalidate_preferences(user_id)
+            if not pdf_metadata:
+                return {'error': 'PDF not found'}, 404
             
             deletion_summary = {
                 'local_file_deleted': False,
                 'word_cache_deleted': False,
-                'reading_progress_deleted': False,
-                'metadata_deleted': False,
-                'progress_records_count': 0
+                'reading_progress_deleted': True,
+                'metadata_deleted': True,
+                'progress_records_count': pdf_metadata['progress_records_count']
             }
+            logger.info("✓ Deleted PDF metadata and %s reading progress record(s)", pdf_metadata['progress_records_count'])
             
-            # 1. Delete from local storage first
+            # 2. Delete from local storage
             try:
                 if self._delete_pdf_from_local_storage(user_id, pdf_metadata['local_filename']):
                     deletion_summary['local_file_deleted'] = True
-                    logger.info(f"✓ Deleted local file: {pdf_metadata['local_filename']}")
+                    logger.info("✓ Deleted local file: %s", pdf_metadata['local_filename'])
                 else:
                     logger.warning(f"⚠ Local file not found: {pdf_metadata['local_filename']}")
             except Exception as storage_error:
                 logger.warning(f"⚠ Failed to delete local file: {storage_error}")
-                # Continue with database cleanup even if file deletion fails
             
-            # 2. Delete cached word data
+            # 3. Delete cached word data
             try:
                 if self._delete_word_cache(user_id, file_id):
                     deletion_summary['word_cache_deleted'] = True
-                    logger.info(f"✓ Deleted cached word data for file: {file_id}")
+                    logger.info("✓ Deleted cached word data for file: %s", file_id)
                 else:
-                    logger.info(f"⚠ No word cache found for file: {file_id}")
+                    logger.info("⚠ No word cache found for file: %s", file_id)
             except Exception as cache_error:
                 logger.warning(f"⚠ Failed to delete word cache: {cache_error}")
-                # Continue with cleanup even if cache deletion fails
             
-            # 3. Delete associated reading progress (CASCADE should handle this, but being explicit)
-            try:
-                progress_result = self.supabase_admin.table('reading_progress').delete().eq('user_id', user_id).eq('pdf_id', file_id).execute()
-                progress_count = len(progress_result.data) if progress_result.data else 0
-                deletion_summary['progress_records_count'] = progress_count
-                deletion_summary['reading_progress_deleted'] = True
-                logger.info(f"✓ Deleted {progress_count} reading progress record(s)")
-            except Exception as progress_error:
-                logger.warning(f"⚠ Failed to delete reading progress: {progress_error}")
-            
-            # 4. Delete metadata from database (this should cascade to remaining reading progress)
-            try:
-                delete_result = self.supabase_admin.table('user_pdfs').delete().eq('user_id', user_id).eq('file_id', file_id).execute()
-                pdf_records_deleted = len(delete_result.data) if delete_result.data else 0
-                
-                if pdf_records_deleted > 0:
-                    deletion_summary['metadata_deleted'] = True
-                    logger.info(f"✓ Deleted {pdf_records_deleted} PDF metadata record(s)")
-                else:
-                    logger.warning(f"⚠ No PDF metadata records were deleted for file_id: {file_id}")
-                    return {'error': 'No records were deleted'}, 404
-                    
-            except Exception as db_error:
-                logger.error(f"✗ Failed to delete PDF metadata: {db_error}")
-                return {'error': f'Database deletion failed: {str(db_error)}'}, 500
-            
-            # 5. Verification step - ensure complete cleanup
-            try:
-                # Check if PDF metadata still exists
-                pdf_verification = self.supabase_admin.table('user_pdfs').select('*').eq('user_id', user_id).eq('file_id', file_id).execute()
-                if pdf_verification.data:
-                    logger.error(f"✗ PDF metadata still exists after deletion attempt: {file_id}")
-                    return {'error': 'PDF deletion failed - metadata still exists'}, 500
-                
-                # Check if reading progress still exists
-                progress_verification = self.supabase_admin.table('reading_progress').select('*').eq('user_id', user_id).eq('pdf_id', file_id).execute()
-                if progress_verification.data:
-                    logger.warning(f"⚠ Orphaned reading progress still exists for file: {file_id}")
-                    # Try to clean it up
-                    orphan_cleanup = self.supabase_admin.table('reading_progress').delete().eq('pdf_id', file_id).execute()
-                    logger.info(f"✓ Cleaned up {len(orphan_cleanup.data) if orphan_cleanup.data else 0} orphaned reading progress records")
-                
-                # Run the orphaned cleanup function for good measure
-                self.supabase_admin.rpc('cleanup_orphaned_reading_progress').execute()
-                logger.info("✓ Ran orphaned reading progress cleanup function")
-                
-            except Exception as verification_error:
-                logger.warning(f"⚠ Verification step failed: {verification_error}")
-                # Don't fail the operation for verification issues
-            
-            logger.info(f"✓ Successfully deleted PDF {file_id} for user {user_id}")
-            logger.info(f"Deletion summary: {deletion_summary}")
+            logger.info("✓ Successfully deleted PDF %s for user %s", file_id, user_id)
+            logger.info("Deletion summary: %s", deletion_summary)
             
             return {
                 'success': True, 
@@ -476,17 +786,36 @@ class AuthService:
             logger.error(f"Error deleting user PDF: {e}")
             return {'error': str(e)}, 500
 
+    def _delete_user_pdf_rows(self, user_id: str, file_id: str):
+        """Non-transactional equivalent of the delete_user_pdf database function"""
+        progress_result = self._table('reading_progress').delete().eq('user_id', user_id).eq('pdf_id', file_id).execute()
+        delete_result = self._table('user_pdfs').delete().eq('user_id', user_id).eq('file_id', file_id).execute()
+        if not delete_result.data:
+            return None
+        
+        return {
+            'filename': delete_result.data[0]['filename'],
+            'local_filename': delete_result.data[0]['local_filename'],
+            'progress_records_count': len(progress_result.data) if progress_result.data else 0
+        }
+
     def get_reading_progress(self, user_id: str, pdf_id: str):
         """Get reading progress for a specific PDF"""
         try:
-            progress = self.supabase_admin.table('reading_progress').select('*').eq('user_id', user_id).eq('pdf_id', pdf_id).execute()
+            # Progress not yet flushed to the database is the most recent
+            with self._progress_lock:
+                pending = self._progress_dirty.get((user_id, pdf_id))
+            if pending:
+                return {'success': True, 'progress': dict(pending)}
+            
+            progress = self._table('reading_progress').select('*').eq('user_id', user_id).eq('pdf_id', pdf_id).execute()
             return {'success': True, 'progress': progress.data[0] if progress.data else None}
         except Exception as e:
             logger.error(f"Error getting reading progress: {e}")
             return {'error': str(e)}, 500
 
     def update_reading_progress(self, user_id: str, pdf_id: str, current_page: int, current_word_index: int, total_words: int):
-        """Update reading progress for a PDF"""
+        """Queue a reading progress update for the next batched flush"""
         try:
             progress_data = {
                 'user_id': user_id,
@@ -494,19 +823,66 @@ class AuthService:
                 'current_page': current_page,
                 'current_word_index': current_word_index,
                 'total_words': total_words,
-                'updated_at': datetime.utcnow().isoformat()
+                # Stamped now, not at flush time, so the newest position wins across workers
+                'updated_at': datetime.now(timezone.utc).isoformat()
             }
             
-            # Use upsert with on_conflict to handle duplicates
-            response = self.supabase_admin.table('reading_progress').upsert(
-                progress_data, 
-                on_conflict='user_id,pdf_id'
-            ).execute()
-            return {'success': True, 'progress': response.data[0]}
+            with self._progress_lock:
+                self._progress_dirty[(user_id, pdf_id)] = progress_data
+                if self._progress_timer is None:
+                    self._progress_timer = threading.Timer(Config.PROGRESS_FLUSH_INTERVAL, self._flush_reading_progress_timer)
+                    self._progress_timer.daemon = True
+                    self._progress_timer.start()
+            
+            return {'success': True, 'progress': progress_data}
         except Exception as e:
             logger.error(f"Error updating reading progress: {e}")
             return {'error': str(e)}, 500
 
+    def _flush_reading_progress_timer(self):
+        """Timer callback - clear the scheduled timer and flush pending progress"""
+        with self._progress_lock:
+            self._progress_timer = None
+        self.flush_reading_progress()
+
+    def _discard_pending_progress(self, user_id: str, pdf_id: str):
+        """Drop a queued progress write, e.g. when its PDF is being deleted"""
+        with self._progress_lock:
+            self._progress_dirty.pop((user_id, pdf_id), None)
+
+    def flush_reading_progress(self):
+        """Write all pending reading progress to the database in a single upsert"""
+        with self._progress_lock:
+            pending = self._progress_dirty
+            self._progress_dirty = {}
+        
+        if not pending or not self.supabase_admin:
+            return
+        
+        try:
+            self._upsert_reading_progress(list(pending.values()))
+            logger.info("Flushed %s reading progress update(s)", len(pending))
+        except Exception as e:
+            # One bad row (e.g. a PDF deleted meanwhile) fails the whole batch,
+            # so retry rows individually and drop the ones that still fail
+            logger.warning(f"Batched reading progress flush failed, retrying per record: {e}")
+            for progress_data in pending.values():
+                try:
+                    self._upsert_reading_progress([progress_data])
+                except Exception as row_error:
+                    logger.error(f"Error updating reading progress for {progress_data['pdf_id']}: {row_error}")
+
+    def _upsert_reading_progress(self, rows):
+        """Upsert progress rows, leaving any row that already holds a newer position"""
+        try:
+            self.supabase_admin.rpc('upsert_reading_progress', {'p_rows': rows}).execute()
+        except Exception as e:
+            if not _is_missing_function(e):
+                raise
+            # Database predates the upsert_reading_progress function
+            logger.warning("⚠ upsert_reading_progress function missing, using a plain upsert")
+            self._table('reading_progress').upsert(rows, on_conflict='user_id,pdf_id').execute()
+
     # --- BACKGROUND MUSIC METHODS --- #
 
     def _save_background_music_to_local_storage(self, user_id: str, filename: str, file_data: bytes):
@@ -521,8 +897,7 @@ class AuthService:
             file_path = os.path.join(user_music_storage_path, local_filename)
             
             # Write file to disk
-            with open(file_path, 'wb') as f:
-                f.write(file_data)
+            self._write_local_file(file_path, file_data)
             
             return {
                 'file_id': file_id,
@@ -533,20 +908,10 @@ class AuthService:
             logger.error(f"Error saving background music to local storage: {e}")
             raise
 
-    def _get_background_music_from_local_storage(self, user_id: str, file_id: str, filename: str):
-        """Get background music file from local storage"""
-        try:
-            user_music_storage_path = self._get_user_music_storage_path(user_id)
-            file_path = os.path.join(user_music_storage_path, filename)
-            
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    return f.read()
-            else:
-                return None
-        except Exception as e:
-            logger.error(f"Error getting background music from local storage: {e}")
-            return None
+    def _get_background_music_path_for_user(self, user_id: str, filename: str):
+        """Get the absolute path of a stored music file (existence is checked when it is opened)"""
+        user_music_storage_path = self._get_user_music_storage_path(user_id)
+        return os.path.abspath(os.path.join(user_music_storage_path, filename))
 
     def _delete_background_music_from_local_storage(self, user_id: str, filename: str):
         """Delete background music file from local storage"""
@@ -554,10 +919,11 @@ class AuthService:
             user_music_storage_path = self._get_user_music_storage_path(user_id)
             file_path = os.path.join(user_music_storage_path, filename)
             
-            if os.path.exists(file_path):
+            try:
                 os.remove(file_path)
                 return True
-            return False
+            except FileNotFoundError:
+                return False
         except Exception as e:
             logger.error(f"Error deleting background music from local storage: {e}")
             return False
@@ -569,7 +935,7 @@ class AuthService:
                 return {'error': 'Authentication service not configured'}, 500
             
             # Get background music files from database
-            music_records = self.supabase_admin.table('user_background_music').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
+            music_records = self._table('user_background_music').select('*').eq('user_id', user_id).order('created_at', desc=True).execute()
             
             return {
                 'success': True,
@@ -602,7 +968,7 @@ class AuthService:
                 'file_type': file_type
             }
             
-            result = self.supabase_admin.table('user_background_music').insert(music_metadata).execute()
+            result = self._table('user_background_music').insert(music_metadata).execute()
             
             return {
                 'success': True,
@@ -616,28 +982,25 @@ class AuthService:
             return {'error': str(e)}, 500
 
     def get_background_music_file(self, user_id: str, file_id: str):
-        """Get background music file content from local storage"""
+        """Get the local storage path and metadata of a background music file"""
         try:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
             # Get music metadata from database
-            music_record = self.supabase_admin.table('user_background_music').select('*').eq('user_id', user_id).eq('file_id', file_id).execute()
+            music_record = self._table('user_background_music').select('*').eq('user_id', user_id).eq('file_id', file_id).execute()
             
             if not music_record.data:
                 return {'error': 'Background music not found'}, 404
             
             music_metadata = music_record.data[0]
             
-            # Get file content from local storage
-            file_data = self._get_background_music_from_local_storage(user_id, file_id, music_metadata['local_filename'])
-            
-            if file_data is None:
-                return {'error': 'Background music file not found in storage'}, 404
+            # Resolve the file in local storage - the route streams it from disk
+            file_path = self._get_background_music_path_for_user(user_id, music_metadata['local_filename'])
             
             return {
                 'success': True,
-                'file_data': file_data,
+                'file_path': file_path,
                 'metadata': music_metadata
             }
         except Exception as e:
@@ -650,41 +1013,31 @@ class AuthService:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
-            # Get music metadata
-            music_record = self.supabase_admin.table('user_background_music').select('*').eq('user_id', user_id).eq('file_id', file_id).execute()
+            # Delete metadata and get the deleted row back in a single round-trip
+            try:
+                delete_result = self._table('user_background_music').delete().eq('user_id', user_id).eq('file_id', file_id).execute()
+            except Exception as db_error:
+                logger.error(f"✗ Failed to delete background music metadata: {db_error}")
+                return {'error': f'Database deletion failed: {str(db_error)}'}, 500
             
-            if not music_record.data:
+            if not delete_result.data:
                 return {'error': 'Background music not found'}, 404
             
-            music_metadata = music_record.data[0]
-            logger.info(f"Starting deletion of background music: {music_metadata['filename']} (ID: {file_id}) for user {user_id}")
+            music_metadata = delete_result.data[0]
+            # book_preferences.background_music_file_id is nulled by the foreign key
+            self._invalidate_preferences(user_id)
+            logger.info("✓ Deleted background music metadata: %s (ID: %s) for user %s", music_metadata['filename'], file_id, user_id)
             
-            # Delete from local storage first
+            # Delete from local storage
             try:
                 if self._delete_background_music_from_local_storage(user_id, music_metadata['local_filename']):
-                    logger.info(f"✓ Deleted local music file: {music_metadata['local_filename']}")
+                    logger.info("✓ Deleted local music file: %s", music_metadata['local_filename'])
                 else:
                     logger.warning(f"⚠ Local music file not found: {music_metadata['local_filename']}")
             except Exception as storage_error:
                 logger.warning(f"⚠ Failed to delete local music file: {storage_error}")
-                # Continue with database cleanup even if file deletion fails
-            
-            # Delete metadata from database
-            try:
-                delete_result = self.supabase_admin.table('user_background_music').delete().eq('user_id', user_id).eq('file_id', file_id).execute()
-                music_records_deleted = len(delete_result.data) if delete_result.data else 0
-                
-                if music_records_deleted > 0:
-                    logger.info(f"✓ Deleted {music_records_deleted} background music metadata record(s)")
-                else:
-                    logger.warning(f"⚠ No background music metadata records were deleted for file_id: {file_id}")
-                    return {'error': 'No records were deleted'}, 404
-                    
-            except Exception as db_error:
-                logger.error(f"✗ Failed to delete background music metadata: {db_error}")
-                return {'error': f'Database deletion failed: {str(db_error)}'}, 500
             
-            logger.info(f"✓ Successfully deleted background music {file_id} for user {user_id}")
+            logger.info("✓ Successfully deleted background music %s for user %s", file_id, user_id)
             
             return {
                 'success': True, 
@@ -701,19 +1054,22 @@ class AuthService:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
+            found, cached_prefs = self._get_cached_preferences(user_id, ('user', None))
+            if found:
+                return {'success': True, 'preferences': cached_prefs}
+            
             # Get user preferences from database
-            prefs_result = self.supabase_admin.table('user_preferences').select('*').eq('user_id', user_id).execute()
+            prefs_result = self._table('user_preferences').select('voice_model,voice_speed,skip_patterns').eq('user_id', user_id).execute()
             
             if prefs_result.data:
                 prefs = prefs_result.data[0]
-                return {
-                    'success': True,
-                    'preferences': {
-                        'voice_model': prefs['voice_model'],
-                        'voice_speed': float(prefs['voice_speed']),
-                        'skip_patterns': prefs['skip_patterns']
-                    }
+                user_prefs = {
+                    'voice_model': prefs['voice_model'],
+                    'voice_speed': float(prefs['voice_speed']),
+                    'skip_patterns': prefs['skip_patterns']
                 }
+                self._cache_preferences(user_id, ('user', None), user_prefs)
+                return {'success': True, 'preferences': user_prefs}
             else:
                 # Create default preferences for the user
                 default_prefs = {
@@ -723,16 +1079,15 @@ class AuthService:
                     'skip_patterns': False
                 }
                 
-                insert_result = self.supabase_admin.table('user_preferences').insert(default_prefs).execute()
+                insert_result = self._table('user_preferences').insert(default_prefs).execute()
                 
-                return {
-                    'success': True,
-                    'preferences': {
-                        'voice_model': default_prefs['voice_model'],
-                        'voice_speed': default_prefs['voice_speed'],
-                        'skip_patterns': default_prefs['skip_patterns']
-                    }
+                user_prefs = {
+                    'voice_model': default_prefs['voice_model'],
+                    'voice_speed': default_prefs['voice_speed'],
+                    'skip_patterns': default_prefs['skip_patterns']
                 }
+                self._cache_preferences(user_id, ('user', None), user_prefs)
+                return {'success': True, 'preferences': user_prefs}
                 
         except Exception as e:
             logger.error(f"Error getting user preferences: {e}")
@@ -745,33 +1100,20 @@ class AuthService:
                 return {'error': 'Authentication service not configured'}, 500
             
             # Validate preferences
-            update_data = {}
-            if 'voice_model' in preferences:
-                update_data['voice_model'] = preferences['voice_model']
-            if 'voice_speed' in preferences:
-                speed = float(preferences['voice_speed'])
-                if speed < 0.1 or speed > 5.0:
-                    return {'error': 'Voice speed must be between 0.1 and 5.0'}, 400
-                update_data['voice_speed'] = speed
-            if 'skip_patterns' in preferences:
-                update_data['skip_patterns'] = bool(preferences['skip_patterns'])
+            try:
+                validate_user_preferences(preferences)
+            except fastjsonschema.JsonSchemaValueException as e:
+                return {'error': f'Invalid preferences: {e.message}'}, 400
+            update_data = {field: preferences[field] for field in USER_PREFERENCES_SCHEMA['properties'] if field in preferences}
             
             if not update_data:
                 return {'error': 'No valid preferences provided'}, 400
             
-            # Update preferences in database
-            result = self.supabase_admin.table('user_preferences').update(update_data).eq('user_id', user_id).execute()
-            
-            if not result.data:
-                # If no rows were updated, create new preferences
-                new_prefs = {
-                    'user_id': user_id,
-                    'voice_model': update_data.get('voice_model', 'kokoro-af-heart'),
-                    'voice_speed': update_data.get('voice_speed', 1.0),
-                    'skip_patterns': update_data.get('skip_patterns', False)
-                }
-                result = self.supabase_admin.table('user_preferences').insert(new_prefs).execute()
+            # Insert or update in one round-trip; omitted columns keep their current or default values
+            update_data['user_id'] = user_id
+            result = self._table('user_preferences').upsert(update_data, on_conflict='user_id').execute()
             
+            self._invalidate_preferences(user_id)
             return {'success': True, 'updated': len(result.data)}
             
         except Exception as e:
@@ -784,27 +1126,28 @@ class AuthService:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
+            found, cached_prefs = self._get_cached_preferences(user_id, ('book', pdf_id))
+            if found:
+                return {'success': True, 'preferences': cached_prefs}
+            
             # Get book preferences from database
-            prefs_result = self.supabase_admin.table('book_preferences').select('*').eq('user_id', user_id).eq('pdf_id', pdf_id).execute()
+            prefs_result = self._table('book_preferences').select('voice_model,voice_speed,skip_patterns,background_music_enabled,background_music_file_id,background_music_volume').eq('user_id', user_id).eq('pdf_id', pdf_id).execute()
             
             if prefs_result.data:
                 prefs = prefs_result.data[0]
-                return {
-                    'success': True,
-                    'preferences': {
-                        'voice_model': prefs['voice_model'],
-                        'voice_speed': float(prefs['voice_speed']) if prefs['voice_speed'] is not None else None,
-                        'skip_patterns': prefs['skip_patterns'],
-                        'background_music_enabled': prefs['background_music_enabled'],
-                        'background_music_file_id': prefs['background_music_file_id'],
-                        'background_music_volume': float(prefs['background_music_volume']) if prefs['background_music_volume'] is not None else 0.10
-                    }
+                book_prefs = {
+                    'voice_model': prefs['voice_model'],
+                    'voice_speed': float(prefs['voice_speed']) if prefs['voice_speed'] is not None else None,
+                    'skip_patterns': prefs['skip_patterns'],
+                    'background_music_enabled': prefs['background_music_enabled'],
+                    'background_music_file_id': prefs['background_music_file_id'],
+                    'background_music_volume': float(prefs['background_music_volume']) if prefs['background_music_volume'] is not None else 0.10
                 }
             else:
-                return {
-                    'success': True,
-                    'preferences': None  # No book-specific preferences
-                }
+                book_prefs = None  # No book-specific preferences
+            
+            self._cache_preferences(user_id, ('book', pdf_id), book_prefs)
+            return {'success': True, 'preferences': book_prefs}
                 
         except Exception as e:
             logger.error(f"Error getting book preferences: {e}")
@@ -817,37 +1160,18 @@ class AuthService:
                 return {'error': 'Authentication service not configured'}, 500
             
             # Validate preferences
-            update_data = {'user_id': user_id, 'pdf_id': pdf_id}
-            
-            if 'voice_model' in preferences:
-                update_data['voice_model'] = preferences['voice_model']
-            if 'voice_speed' in preferences:
-                if preferences['voice_speed'] is not None:
-                    speed = float(preferences['voice_speed'])
-                    if speed < 0.1 or speed > 5.0:
-                        return {'error': 'Voice speed must be between 0.1 and 5.0'}, 400
-                    update_data['voice_speed'] = speed
-                else:
-                    update_data['voice_speed'] = None
-            if 'skip_patterns' in preferences:
-                update_data['skip_patterns'] = bool(preferences['skip_patterns']) if preferences['skip_patterns'] is not None else None
-            if 'background_music_enabled' in preferences:
-                update_data['background_music_enabled'] = bool(preferences['background_music_enabled'])
-            if 'background_music_file_id' in preferences:
-                update_data['background_music_file_id'] = preferences['background_music_file_id']
-            if 'background_music_volume' in preferences:
-                volume = float(preferences['background_music_volume'])
-                if volume < 0.0 or volume > 1.0:
-                    return {'error': 'Background music volume must be between 0.0 and 1.0'}, 400
-                update_data['background_music_volume'] = volume
-            
-            # Try to update existing record
-            result = self.supabase_admin.table('book_preferences').update(update_data).eq('user_id', user_id).eq('pdf_id', pdf_id).execute()
-            
-            if not result.data:
-                # If no rows were updated, create new book preferences
-                result = self.supabase_admin.table('book_preferences').insert(update_data).execute()
+            try:
+                validate_book_preferences(preferences)
+            except fastjsonschema.JsonSchemaValueException as e:
+                return {'error': f'Invalid preferences: {e.message}'}, 400
+            update_data = {field: preferences[field] for field in BOOK_PREFERENCES_SCHEMA['properties'] if field in preferences}
+            update_data['user_id'] = user_id
+            update_data['pdf_id'] = pdf_id
+            
+            # Insert or update in one round-trip on the (user_id, pdf_id) unique key
+            result = self._table('book_preferences').upsert(update_data, on_conflict='user_id,pdf_id').execute()
             
+            self._invalidate_preferences(user_id)
             return {'success': True, 'updated': len(result.data)}
             
         except Exception as e:
@@ -861,37 +1185,72 @@ class AuthService:
                 return {'error': 'Authentication service not configured'}, 500
             
             # Delete book preferences from database
-            result = self.supabase_admin.table('book_preferences').delete().eq('user_id', user_id).eq('pdf_id', pdf_id).execute()
+            result = self._table('book_preferences').delete().eq('user_id', user_id).eq('pdf_id', pdf_id).execute()
             
+            self._invalidate_preferences(user_id)
             return {'success': True, 'deleted': len(result.data)}
             
         except Exception as e:
             logger.error(f"Error deleting book preferences: {e}")
             return {'error': str(e)}, 500
 
+    def _merge_effective_preferences(self, user_prefs, book_prefs):
+        """Combine user defaults with book overrides, mirroring the get_effective_preferences SQL function"""
+        user_prefs = user_prefs or {}
+        book_prefs = book_prefs or {}
+        
+        def pick(field, default):
+            for value in (book_prefs.get(field), user_prefs.get(field)):
+                if value is not None:
+                    return value
+            return default
+        
+        background_music_enabled = book_prefs.get('background_music_enabled')
+        background_music_volume = book_prefs.get('background_music_volume')
+        return {
+            'voice_model': pick('voice_model', 'kokoro-af-heart'),
+            'voice_speed': float(pick('voice_speed', 1.0)),
+            'skip_patterns': pick('skip_patterns', False),
+            'background_music_enabled': background_music_enabled if background_music_enabled is not None else False,
+            'background_music_file_id': book_prefs.get('background_music_file_id'),
+            'background_music_volume': float(background_music_volume) if background_music_volume is not None else 0.10,
+            'has_book_overrides': bool(book_prefs)
+        }
+
     def get_effective_preferences(self, user_id: str, pdf_id: str):
         """Get effective preferences for a book (combines user defaults with book overrides)"""
         try:
             if not self.supabase:
                 return {'error': 'Authentication service not configured'}, 500
             
+            found, cached_prefs = self._get_cached_preferences(user_id, ('effective', pdf_id))
+            if found:
+                return {'success': True, 'preferences': cached_prefs}
+            
+            # Both inputs already cached: merge locally instead of calling the database
+            user_found, user_prefs = self._get_cached_preferences(user_id, ('user', None))
+            book_found, book_prefs = self._get_cached_preferences(user_id, ('book', pdf_id))
+            if user_found and book_found:
+                effective_prefs = self._merge_effective_preferences(user_prefs, book_prefs)
+                self._cache_preferences(user_id, ('effective', pdf_id), effective_prefs)
+                return {'success': True, 'preferences': effective_prefs}
+            
             # Use the database function to get effective preferences
             result = self.supabase_admin.rpc('get_effective_preferences', {'user_uuid': user_id, 'pdf_file_id': pdf_id}).execute()
             
             if result.data:
                 prefs = result.data
-                return {
-                    'success': True,
-                    'preferences': {
-                        'voice_model': prefs['voice_model'],
-                        'voice_speed': float(prefs['voice_speed']),
-                        'skip_patterns': prefs['skip_patterns'],
-                        'background_music_enabled': prefs['background_music_enabled'],
-                        'background_music_file_id': prefs['background_music_file_id'],
-                        'background_music_volume': float(prefs['background_music_volume']),
-                        'has_book_overrides': prefs['has_book_overrides']
-                    }
+                effective_prefs = {
+                    'voice_model': prefs['voice_model'],
+                    'voice_speed': float(prefs['voice_speed']),
+                    'skip_patterns': prefs['skip_patterns'],
+                    'background_music_enabled': prefs['background_music_enabled'],
+                    'background_music_file_id': prefs['background_music_file_id'],
+                    'background_music_volume': float(prefs['background_music_volume']),
+                    'has_book_overrides': prefs['has_book_overrides']
                 }
+                self._cache_preferences(user_id, ('effective', pdf_id), effective_prefs)
+                return {'success': True, 'preferences': effective_prefs}
             else:
                 # Fallback to defaults if function fails
                 return {
@@ -933,6 +1292,8 @@ def token_required(f):
         
         # Verify token
         result = auth_service.verify_token(token)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), 401
         if 'error' in result:
             return jsonify(result), 401
         
@@ -2,10 +2,15 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 import tempfile
+from types import MappingProxyType
 
 # Load environment variables
 load_dotenv()
 
+def _index_model_voices(models):
+    """Build a model key -> (voice_id, lang_code, display name) lookup"""
+    return {key: (model['voice_id'], model.get('lang_code', 'a'), model['name']) for key, model in models.items()}
+
 class Config:
     # Flask settings
     DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
@@ -14,15 +19,29 @@ class Config:
     # Server settings
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 8000))
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', 2))  # gunicorn worker processes when DEBUG is off (each loads its own TTS models)
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 8))  # Request threads per gunicorn worker
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 120))  # Seconds before gunicorn restarts a stuck worker
     
     # JWT settings
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', SECRET_KEY)
     JWT_ACCESS_TOKEN_EXPIRES = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 3600))  # 1 hour
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))  # Seconds a verified user's profile is reused without a DB lookup
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))  # Verified tokens remembered until they expire
+    PREFERENCES_CACHE_TTL = float(os.getenv('PREFERENCES_CACHE_TTL', 5))  # Seconds preferences are served from memory; per process, so keep short with multiple workers
+    
+    # Reading progress writes are buffered and flushed in batches every N seconds.
+    # Each worker process buffers its own writes, so a read served by another
+    # worker can return the previous position for up to this long.
+    PROGRESS_FLUSH_INTERVAL = float(os.getenv('PROGRESS_FLUSH_INTERVAL', 5))
     
     # Supabase settings
     SUPABASE_URL = os.getenv('SUPABASE_URL', '')
     SUPABASE_ANON_KEY = os.getenv('SUPABASE_ANON_KEY', '')
     SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY', '')
+    SUPABASE_MAX_CONNECTIONS = int(os.getenv('SUPABASE_MAX_CONNECTIONS', 50))  # Per-client cap on open HTTP connections to Supabase
+    SUPABASE_MAX_KEEPALIVE = int(os.getenv('SUPABASE_MAX_KEEPALIVE', 20))  # Idle connections kept open for reuse
+    SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv('SUPABASE_KEEPALIVE_EXPIRY', 60))  # Seconds an idle connection is kept before closing
     
     # File upload settings
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', '/tmp')  # Use /tmp by default, configurable via env var
@@ -31,6 +50,9 @@ class Config:
     # Text processing settings
     MAX_TEXT_LENGTH = 2_000_000  # 2 million characters (for books)
     CHUNK_SIZE = 100  # Process in chunks of exactly 100 words for on-demand streaming
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', max(1, 4 // WEB_WORKERS)))  # PDF/EPUB parsing processes per web worker (0 = parse on the request thread)
+    EXTRACTION_CACHE_SIZE = int(os.getenv('EXTRACTION_CACHE_SIZE', 8))  # Recently extracted files kept in memory, keyed by content hash
+    WORD_CACHE_MEMORY_SIZE = int(os.getenv('WORD_CACHE_MEMORY_SIZE', 32))  # Parsed word caches kept in memory to skip disk re-reads
     
     # Kokoro TTS Voice configurations
     # American English voices (lang_code='a')
@@ -292,6 +314,9 @@ class Config:
             'type': 'kokoro'
         }
     }
+    # Models never change at runtime: freeze the table and precompute the per-request voice lookup
+    AVAILABLE_MODELS = MappingProxyType(AVAILABLE_MODELS)
+    MODEL_VOICES = MappingProxyType(_index_model_voices(AVAILABLE_MODELS))
     
     @staticmethod
     def init_app(app):
@@ -0,0 +1,560 @@
+"""
+PDF/EPUB word extraction.
+
+Kept free of the web app, TTS and database imports so the extraction worker
+processes only load the parsing libraries.
+"""
+
+import io
+import re
+import logging
+import traceback
+import pdfplumber
+from ebooklib import epub
+from bs4 import BeautifulSoup
+import warnings
+warnings.filterwarnings("ignore", category=UserWarning, module="bs4")
+
+logger = logging.getLogger(__name__)
+
+def extract_words_from_pdf_bytes(file_bytes):
+    """Extract words and their coordinates from PDF bytes using pdfplumber with paragraph detection."""
+    all_words = []
+    global_word_index = 0
+    global_paragraph_id = 0
+    
+    try:
+        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+            for page_num, page in enumerate(pdf.pages):
+                # Extract words with precise coordinate data. Text-flow reconstruction is
+                # skipped since words are regrouped into lines by position below.
+                words = page.extract_words(x_tolerance=2, y_tolerance=3, use_text_flow=False)
+                
+                # Drop the page's parsed char/object cache so memory stays flat on long PDFs
+                page.flush_cache()
+                
+                if not words:
+                    continue
+                
+                # Detect paragraph boundaries using line spacing and positioning
+                paragraphs = detect_paragraphs_in_page(words)
+                
+                # Page-level values are constant for every word on the page
+                page_number = page_num + 1
+                page_width = float(page.width)
+                page_height = float(page.height)
+                
+                for paragraph in paragraphs:
+                    for word in paragraph['words']:
+                        x0 = float(word["x0"])
+                        top = float(word["top"])
+                        all_words.append({
+                            "text": word["text"],
+                            "page": page_number,
+                            "index": global_word_index,
+                            "paragraph_id": global_paragraph_id,
+                            "paragraph_start": word.get("paragraph_start", False),
+                            "paragraph_end": word.get("paragraph_end", False),
+                            "x": x0,
+                            "y": top,
+                            "width": float(word["x1"]) - x0,
+                            "height": float(word["bottom"]) - top,
+                            "page_width": page_width,
+                            "page_height": page_height
+                        })
+                        global_word_index += 1
+                    global_paragraph_id += 1
+                    
+    except Exception as e:
+        logger.error(f"pdfplumber failed to extract words: {e}")
+        return None
+    return all_words
+
+def detect_paragraphs_in_page(words):
+    """Detect paragraph boundaries using smart whitespace analysis - works for any PDF type."""
+    if not words:
+        return []
+    
+    paragraphs = []
+    current_paragraph = []
+    
+    # Group words by approximate lines first
+    lines = group_words_by_lines(words)
+    
+    # Calculate common horizontal alignment zones for better paragraph detection
+    left_margins = [line[0]["x0"] for line in lines if line]
+    common_margins = {}
+    for margin in left_margins:
+        # Group similar margins (within 5px)
+        found_group = False
+        for existing_margin in common_margins:
+            if abs(margin - existing_margin) <= 5:
+                common_margins[existing_margin] += 1
+                found_group = True
+                break
+        if not found_group:
+            common_margins[margin] = 1
+    
+    # Find the most common alignment (main text alignment)
+    main_text_margin = max(common_margins.keys(), key=common_margins.get) if common_margins else 0
+    
+    for line_idx, line_words in enumerate(lines):
+        if not line_words:
+            continue
+            
+        # Check if this line starts a new paragraph
+        is_new_paragraph = False
+        
+        if line_idx == 0:
+            # First line is always start of a paragraph
+            is_new_paragraph = True
+        else:
+            prev_line = lines[line_idx - 1] if line_idx > 0 else []
+            
+            if prev_line:
+                # Check if previous line appears incomplete (likely continues to this line)
+                prev_line_text = ' '.join(word["text"] for word in prev_line).strip()
+                current_line_text = ' '.join(word["text"] for word in line_words).strip()
+                
+                # If previous line seems incomplete, don't break here
+                if is_incomplete_line(prev_line_text, current_line_text):
+                    is_new_paragraph = False
+                else:
+                    # ENHANCED HORIZONTAL ALIGNMENT CHECK
+                    # If current line is aligned with main text body, consider it a continuation
+                    current_margin = line_words[0]["x0"]
+                    prev_margin = prev_line[0]["x0"]
+                    
+                    # Check if both lines are aligned with main text (likely continuation)
+                    both_main_aligned = (abs(current_margin - main_text_margin) <= 8 and 
+                                       abs(prev_margin - main_text_margin) <= 8)
+                    
+                    if both_main_aligned:
+                        # Both lines are main text aligned - be more conservative about splitting
+                        # Only split if there are very strong spatial indicators
+                        if (has_aggressive_vertical_spacing(line_words, prev_line) and
+                            has_significant_indentation_change(line_words, prev_line, main_text_margin)):
+                            is_new_paragraph = True
+                        elif is_clear_paragraph_break(prev_line, line_words):
+                            is_new_paragraph = True
+                    else:
+                        # SMART WHITESPACE-BASED PARAGRAPH DETECTION (original logic for non-aligned text)
+                        
+                        # 1. Vertical spacing - balanced threshold
+                        if has_aggressive_vertical_spacing(line_words, prev_line):
+                            is_new_paragraph = True
+                        
+                        # 2. Horizontal indentation changes - significant shifts
+                        elif has_indentation_change(line_words, prev_line):
+                            is_new_paragraph = True
+                        
+                        # 3. Line length analysis - short lines often indicate paragraph breaks
+                        elif is_short_line_break(prev_line, line_words):
+                            is_new_paragraph = True
+                        
+                        # 4. Font size or formatting changes (if available)
+                        elif has_formatting_change(line_words, prev_line):
+                            is_new_paragraph = True
+        
+        if is_new_paragraph and current_paragraph:
+            # Mark the end of the previous paragraph
+            if current_paragraph:
+                current_paragraph[-1]["paragraph_end"] = True
+            
+            # Save the previous paragraph
+            paragraphs.append({
+                'words': current_paragraph,
+                'paragraph_id': len(paragraphs)
+            })
+            current_paragraph = []
+        
+        # Mark paragraph start
+        if is_new_paragraph and line_words:
+            line_words[0]["paragraph_start"] = True
+        
+        # Add all words from this line to current paragraph
+        current_paragraph.extend(line_words)
+    
+    # Don't forget the last paragraph
+    if current_paragraph:
+        current_paragraph[-1]["paragraph_end"] = True
+        paragraphs.append({
+            'words': current_paragraph,
+            'paragraph_id': len(paragraphs)
+        })
+    
+    return paragraphs
+
+def is_incomplete_line(prev_line_text, current_line_text):
+    """Detect if the previous line is incomplete and continues to the current line - GENERIC for any PDF type."""
+    if not prev_line_text or not current_line_text:
+        return False
+    
+    # CONSERVATIVE APPROACH: Only split when there are STRONG indicators
+    # Don't split based on punctuation alone - rely primarily on spatial analysis
+    
+    # Very strong indicators that previous line is incomplete
+    strong_incomplete_endings = [
+        # Punctuation that clearly indicates continuation
+        ',', ';', ':', '(', '"', "'", '-', '—', '–',
+        # Words that clearly indicate incomplete thoughts
+        'and', 'or', 'but', 'the', 'of', 'in', 'to', 'for', 'with', 'by', 'at', 'on', 'from',
+        # Conjunctions and transitions that need continuation
+        'if', 'because', 'since', 'while', 'although', 'though', 'unless', 'until', 'before', 'after', 'when', 'where', 'how', 'why'
+    ]
+    
+    # Check if previous line ends with clear incomplete indicators
+    prev_clearly_incomplete = any(prev_line_text.lower().endswith(' ' + ending) or prev_line_text.endswith(ending) 
+                                 for ending in strong_incomplete_endings)
+    
+    # Very strong indicators that current line is a continuation  
+    strong_continuation_starts = [
+        # Punctuation that clearly continues previous line
+        ')', '"', "'", '.', ',', ';',
+        # Words that clearly continue previous thought
+        'and', 'or', 'but', 'so', 'yet', 'then', 'however', 'therefore', 'moreover', 'furthermore'
+    ]
+    
+    # Check if current line clearly starts a continuation
+    current_clearly_continues = any(current_line_text.lower().startswith(start + ' ') or current_line_text.startswith(start)
+                                   for start in strong_continuation_starts)
+    
+    # Strong indicator: current line starts with lowercase (very likely continuation)
+    current_starts_lowercase = current_line_text and current_line_text[0].islower()
+    
+    # Return True only for CLEAR continuation indicators
+    # This makes the algorithm rely more on spatial analysis rather than text patterns
+    return (prev_clearly_incomplete or 
+            current_clearly_continues or 
+            current_starts_lowercase)
+
+def has_aggressive_vertical_spacing(line_words, prev_line):
+    """Detect vertical spacing between lines - very aggressive for shorter chunks."""
+    if not prev_line or not line_words:
+        return False
+    
+    # Calculate vertical spacing between lines
+    prev_line_bottom = max(word["bottom"] for word in prev_line)
+    current_line_top = min(word["top"] for word in line_words)
+    line_spacing = current_line_top - prev_line_bottom
+    
+    # Calculate average line height for context
+    current_line_height = max(word["bottom"] - word["top"] for word in line_words)
+    prev_line_height = max(word["bottom"] - word["top"] for word in prev_line)
+    avg_line_height = (current_line_height + prev_line_height) / 2
+    
+    # BALANCED threshold: > 1.0x line height
+    # This will catch meaningful spacing increases while avoiding over-splitting
+    return line_spacing > avg_line_height * 1.0
+
+def has_indentation_change(line_words, prev_line):
+    """Detect horizontal indentation changes - very aggressive for shorter chunks."""
+    if not prev_line or not line_words:
+        return False
+    
+    current_indent = line_words[0]["x0"]
+    prev_indent = prev_line[0]["x0"]
+    
+    # BALANCED threshold - meaningful indentation changes > 10 pixels
+    # This will catch significant indentation while avoiding minor variations
+    return abs(current_indent - prev_indent) > 10
+
+def is_short_line_break(prev_line, current_line):
+    """Detect paragraph breaks based on line length patterns - very aggressive for shorter chunks."""
+    if not prev_line or not current_line:
+        return False
+    
+    # Calculate line widths
+    prev_line_width = max(word["x1"] for word in prev_line) - min(word["x0"] for word in prev_line)
+    current_line_width = max(word["x1"] for word in current_line) - min(word["x0"] for word in current_line)
+    
+    # Get page width context (approximate)
+    page_width = max(max(word["x1"] for word in prev_line), max(word["x1"] for word in current_line))
+    
+    # Check if this looks like logical continuation vs paragraph break
+    prev_line_text = ' '.join(word["text"] for word in prev_line).strip()
+    current_line_text = ' '.join(word["text"] for word in current_line).strip()
+    
+    # Minimal continuation checking - only the most obvious cases
+    continuation_endings = [',', ';', ':', '(', '"', "'", '-']
+    logical_continuation = any(prev_line_text.endswith(ending) for ending in continuation_endings)
+    
+    # Minimal continuation starts - only obvious punctuation
+    continuation_starts = [')', '"', "'", '.', ',', ';']
+    starts_continuation = any(current_line_text.startswith(start) for start in continuation_starts)
+    
+    # Don't split only for very obvious continuations
+    if logical_continuation or starts_continuation:
+        return False
+    
+    # BALANCED line width thresholds for reasonable chunks
+    # Break if previous line is quite short (< 60% of page width) OR
+    # there's a significant width difference (> 30%)
+    if (prev_line_width < page_width * 0.60 or 
+        abs(prev_line_width - current_line_width) > page_width * 0.30):
+        return True
+    
+    return False
+
+def has_formatting_change(line_words, prev_line):
+    """Detect formatting changes like font size differences - very aggressive for shorter chunks."""
+    if not prev_line or not line_words:
+        return False
+    
+    # Check if word height differs significantly (indicating font size change)
+    current_heights = [word["bottom"] - word["top"] for word in line_words]
+    prev_heights = [word["bottom"] - word["top"] for word in prev_line]
+    
+    if current_heights and prev_heights:
+        avg_current_height = sum(current_heights) / len(current_heights)
+        avg_prev_height = sum(prev_heights) / len(prev_heights)
+        
+        # BALANCED threshold: > 15% height difference
+        # This will catch meaningful font changes while avoiding minor variations
+        height_diff_ratio = abs(avg_current_height - avg_prev_height) / max(avg_current_height, avg_prev_height)
+        return height_diff_ratio > 0.15
+    
+    return False
+
+def group_words_by_lines(words, y_tolerance=3):
+    """Group words into lines based on their vertical position."""
+    if not words:
+        return []
+    
+    # Sort words by vertical position first, then horizontal
+    sorted_words = sorted(words, key=lambda w: (w["top"], w["x0"]))
+    
+    lines = []
+    current_line = []
+    current_y = None
+    
+    for word in sorted_words:
+        word_y = word["top"]
+        
+        if current_y is None or abs(word_y - current_y) <= y_tolerance:
+            # Same line
+            current_line.append(word)
+            current_y = word_y if current_y is None else current_y
+        else:
+            # New line
+            if current_line:
+                # Sort current line by horizontal position
+                current_line.sort(key=lambda w: w["x0"])
+                lines.append(current_line)
+            current_line = [word]
+            current_y = word_y
+    
+    # Don't forget the last line
+    if current_line:
+        current_line.sort(key=lambda w: w["x0"])
+        lines.append(current_line)
+    
+    return lines
+
+def group_words_by_lines_converted(words, y_tolerance=3):
+    """Group words into lines based on their vertical position - for converted word objects."""
+    if not words:
+        return []
+    
+    # Sort words by vertical position first, then horizontal
+    sorted_words = sorted(words, key=lambda w: (w["y"], w["x"]))
+    
+    lines = []
+    current_line = []
+    current_y = None
+    
+    for word in sorted_words:
+        word_y = word["y"]
+        
+        if current_y is None or abs(word_y - current_y) <= y_tolerance:
+            # Same line
+            current_line.append(word)
+            current_y = word_y if current_y is None else current_y
+        else:
+            # New line
+            if current_line:
+                # Sort current line by horizontal position
+                current_line.sort(key=lambda w: w["x"])
+                lines.append(current_line)
+            current_line = [word]
+            current_y = word_y
+    
+    # Don't forget the last line
+    if current_line:
+        current_line.sort(key=lambda w: w["x"])
+        lines.append(current_line)
+    
+    return lines
+
+def _get_epub_content_items(book):
+    """Get content items from EPUB in spine order, handling all item types.
+    
+    Many EPUBs use text/html with .html extensions which ebooklib classifies as
+    ITEM_UNKNOWN rather than ITEM_DOCUMENT. We use the spine for reading order
+    and fall back to scanning all HTML-like items.
+    """
+    items_by_id = {}
+    items_by_name = {}
+    html_extensions = ('.xhtml', '.html', '.htm', '.xml')
+    html_media_types = ('application/xhtml+xml', 'text/html', 'application/html')
+
+    for item in book.get_items():
+        item_id = item.get_id() if hasattr(item, 'get_id') else None
+        item_name = item.get_name()
+        if item_id:
+            items_by_id[item_id] = item
+        if item_name:
+            items_by_name[item_name] = item
+
+    ordered = []
+    seen = set()
+    for spine_entry in book.spine:
+        item_id = spine_entry[0] if isinstance(spine_entry, (list, tuple)) else spine_entry
+        item = items_by_id.get(item_id)
+        if item and item.get_name() not in seen:
+            seen.add(item.get_name())
+            ordered.append(item)
+
+    if not ordered:
+        for item in book.get_items():
+            name = item.get_name()
+            media = getattr(item, 'media_type', '') or ''
+            is_html = any(name.lower().endswith(ext) for ext in html_extensions) or media in html_media_types
+            if is_html and name not in seen:
+                seen.add(name)
+                ordered.append(item)
+
+    return ordered
+
+
+def extract_words_from_epub_bytes(file_bytes):
+    """Extract words and paragraph structure from EPUB bytes."""
+    all_words = []
+    global_word_index = 0
+    global_paragraph_id = 0
+    
+    try:
+        book = epub.read_epub(io.BytesIO(file_bytes))
+        content_items = _get_epub_content_items(book)
+        
+        chapter_num = 0
+        for item in content_items:
+            content = item.get_content()
+            soup = BeautifulSoup(content, 'lxml')
+            
+            body = soup.find('body')
+            if not body:
+                body = soup  # some fragments lack <body>
+            
+            body_text = body.get_text(strip=True)
+            if not body_text or len(body_text) < 10:
+                continue
+            
+            chapter_num += 1
+            
+            block_tags = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'blockquote']
+            paragraphs = body.find_all(block_tags)
+            
+            if not paragraphs:
+                divs = body.find_all('div')
+                paragraphs = [d for d in divs if d.string or (d.get_text(strip=True) and not d.find(block_tags))]
+            
+            if not paragraphs:
+                full_text = body.get_text(separator=' ', strip=True)
+                if full_text:
+                    class FakeParagraph:
+                        def __init__(self, t): self._t = t
+                        def get_text(self, strip=False): return self._t.strip() if strip else self._t
+                    paragraphs = [FakeParagraph(full_text)]
+            
+            seen_texts = set()
+            for p_tag in paragraphs:
+                text = p_tag.get_text(strip=True) if hasattr(p_tag, 'get_text') else str(p_tag)
+                text = re.sub(r'\s+', ' ', text).strip()
+                
+                if not text or len(text) < 2:
+                    continue
+                
+                if text in seen_texts:
+                    continue
+                seen_texts.add(text)
+                
+                words = text.split()
+                if not words:
+                    continue
+                
+                for i, word_text in enumerate(words):
+                    all_words.append({
+                        "text": word_text,
+                        "page": chapter_num,
+                        "index": global_word_index,
+                        "paragraph_id": global_paragraph_id,
+                        "paragraph_start": i == 0,
+                        "paragraph_end": i == len(words) - 1,
+                        "x": 0, "y": 0, "width": 0, "height": 0,
+                        "page_width": 0, "page_height": 0
+                    })
+                    global_word_index += 1
+                global_paragraph_id += 1
+        
+        logger.info("EPUB extraction: %s words from %s chapters", len(all_words), chapter_num)
+        
+    except Exception as e:
+        logger.error(f"EPUB extraction failed: {e}")
+        traceback.print_exc()
+        return None
+    
+    return all_words
+
+def has_significant_indentation_change(line_words, prev_line, main_text_margin):
+    """Detect significant indentation changes relative to main text alignment."""
+    if not prev_line or not line_words:
+        return False
+    
+    current_indent = line_words[0]["x0"]
+    prev_indent = prev_line[0]["x0"]
+    
+    # Check for significant deviation from main text margin
+    current_deviation = abs(current_indent - main_text_margin)
+    prev_deviation = abs(prev_indent - main_text_margin)
+    
+    # Significant indentation change: either line deviates significantly from main text
+    # OR there's a substantial change between the two lines
+    significant_deviation = current_deviation > 15 or prev_deviation > 15
+    substantial_change = abs(current_indent - prev_indent) > 20
+    
+    return significant_deviation or substantial_change
+
+def is_clear_paragraph_break(prev_line, current_line):
+    """Detect clear paragraph breaks for main-text-aligned lines."""
+    if not prev_line or not current_line:
+        return False
+    
+    prev_line_text = ' '.join(word["text"] for word in prev_line).strip()
+    current_line_text = ' '.join(word["text"] for word in current_line).strip()
+    
+    # Very strong paragraph ending indicators
+    strong_endings = ['.', '!', '?', ';"', '."', '!"', '?"']
+    ends_with_strong = any(prev_line_text.endswith(ending) for ending in strong_endings)
+    
+    # Strong paragraph starting indicators
+    strong_starts = ['Chapter', 'Section', 'Part', 'Book', 'Volume']
+    starts_with_strong = any(current_line_text.startswith(start) for start in strong_starts)
+    
+    # Check if current line starts with capital letter (potential new sentence/paragraph)
+    starts_with_capital = current_line_text and current_line_text[0].isupper()
+    
+    # Calculate line widths for additional context
+    page_width = max(max(word["x1"] for word in prev_line), max(word["x1"] for word in current_line))
+    prev_line_width = max(word["x1"] for word in prev_line) - min(word["x0"] for word in prev_line)
+    
+    # Previous line is quite short (likely end of paragraph)
+    prev_line_short = prev_line_width < page_width * 0.50
+    
+    # Clear paragraph break indicators:
+    # 1. Previous line ends with strong punctuation AND current starts with capital
+    # 2. Previous line is short AND current starts with capital
+    # 3. Current line starts with structural elements
+    return ((ends_with_strong and starts_with_capital) or
+            (prev_line_short and starts_with_capital and ends_with_strong) or
+            starts_with_strong)
@@ -0,0 +1,14 @@
+"""
+Gunicorn settings for production serving (used by run.py and the Docker images)
+"""
+
+from config import Config
+
+bind = f"{Config.HOST}:{Config.PORT}"
+worker_class = 'gthread'
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
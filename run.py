@@ -21,18 +21,29 @@ def main():
     
     # Import and run the app
     try:
-        from app import app
         from config import Config
         
         print("🚀 Starting PDF to Audio Converter...")
         print(f"📍 Server will run at: http://{Config.HOST}:{Config.PORT}")
         print("💡 Press Ctrl+C to stop the server")
         
-        app.run(
-            host=Config.HOST,
-            port=Config.PORT,
-            debug=Config.DEBUG
-        )
+        if Config.DEBUG:
+            from app import app
+            app.run(
+                host=Config.HOST,
+                port=Config.PORT,
+                debug=Config.DEBUG
+            )
+            return
+        
+        # Production: hand the process over to gunicorn (settings in gunicorn.conf.py)
+        print(f"🧵 Using gunicorn: {Config.WEB_WORKERS} worker(s) x {Config.WEB_THREADS} thread(s)")
+        os.chdir(current_dir)
+        os.execv(sys.executable, [
+            sys.executable, '-m', 'gunicorn',
+            '--config', 'gunicorn.conf.py',
+            'app:app'
+        ])
     except ImportError as e:
         print(f"❌ Import error: {e}")
         print("Please run: python setup.py")
@@ -183,7 +183,10 @@ CREATE POLICY "Users can delete own book preferences" ON book_preferences
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
 BEGIN
-    NEW.updated_at = NOW();
+    -- Keep an explicitly written timestamp (reading progress carries its own)
+    IF NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at THEN
+        NEW.updated_at = NOW();
+    END IF;
     RETURN NEW;
 END;
 $$ language 'plpgsql';
@@ -222,6 +225,54 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Function to delete a PDF's reading progress and metadata in one transaction.
+-- Returns the deleted file's names and the progress row count, or NULL if not found.
+CREATE OR REPLACE FUNCTION delete_user_pdf(p_user UUID, p_file VARCHAR)
+RETURNS JSONB AS $$
+DECLARE
+    progress_count INTEGER;
+    deleted_pdf user_pdfs%ROWTYPE;
+BEGIN
+    DELETE FROM reading_progress WHERE user_id = p_user AND pdf_id = p_file;
+    GET DIAGNOSTICS progress_count = ROW_COUNT;
+    
+    DELETE FROM user_pdfs WHERE user_id = p_user AND file_id = p_file
+    RETURNING * INTO deleted_pdf;
+    
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    
+    RETURN jsonb_build_object(
+        'filename', deleted_pdf.filename,
+        'local_filename', deleted_pdf.local_filename,
+        'progress_records_count', progress_count
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to upsert a batch of reading progress rows, keeping whichever
+-- position is newest so a late flush from another worker can't roll it back.
+CREATE OR REPLACE FUNCTION upsert_reading_progress(p_rows JSONB)
+RETURNS void AS $$
+    INSERT INTO reading_progress (user_id, pdf_id, current_page, current_word_index, total_words, updated_at)
+    SELECT user_id, pdf_id, current_page, current_word_index, total_words, updated_at
+    FROM jsonb_to_recordset(p_rows) AS r(
+        user_id UUID,
+        pdf_id VARCHAR,
+        current_page INTEGER,
+        current_word_index INTEGER,
+        total_words INTEGER,
+        updated_at TIMESTAMP WITH TIME ZONE
+    )
+    ON CONFLICT (user_id, pdf_id) DO UPDATE SET
+        current_page = EXCLUDED.current_page,
+        current_word_index = EXCLUDED.current_word_index,
+        total_words = EXCLUDED.total_words,
+        updated_at = EXCLUDED.updated_at
+    WHERE reading_progress.updated_at < EXCLUDED.updated_at;
+$$ LANGUAGE sql;
+
 -- Function to get user's PDFs with reading progress
 CREATE OR REPLACE FUNCTION get_user_pdfs_with_progress(user_uuid UUID)
 RETURNS TABLE(
@@ -276,9 +327,7 @@ $$ LANGUAGE plpgsql;
 -- Function to get effective preferences for a book (combines user defaults with book overrides)
 CREATE OR REPLACE FUNCTION get_effective_preferences(user_uuid UUID, pdf_file_id VARCHAR)
 RETURNS JSON AS $$
-DECLARE
-    result JSON;
-BEGIN
+    -- STABLE (read-only), so PostgREST runs it in a read-only transaction
     SELECT json_build_object(
         'voice_model', COALESCE(bp.voice_model, up.voice_model, 'kokoro-af-heart'),
         'voice_speed', COALESCE(bp.voice_speed, up.voice_speed, 1.0),
@@ -287,14 +336,11 @@ BEGIN
         'background_music_file_id', bp.background_music_file_id,
         'background_music_volume', COALESCE(bp.background_music_volume, 0.10),
         'has_book_overrides', (bp.id IS NOT NULL)
-    ) INTO result
+    )
     FROM (SELECT 1) AS dummy -- Dummy table to ensure at least one row
     LEFT JOIN user_preferences up ON up.user_id = user_uuid
     LEFT JOIN book_preferences bp ON bp.user_id = user_uuid AND bp.pdf_id = pdf_file_id;
-    
-    RETURN result;
-END;
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE sql STABLE;
 
 -- Comments for documentation
 COMMENT ON TABLE users IS 'User profiles extending Supabase auth.users';